@@ -0,0 +1,192 @@
+"""
+Crawl Frontier
+Priority queue of URLs to crawl with normalization, dedup, depth limits and disk spill
+"""
+
+import gzip
+import heapq
+import itertools
+import re
+import sqlite3
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+# Query parameters that never change page content
+TRACKING_PARAMS = re.compile(r'^(utm_\w+|fbclid|gclid|mc_cid|mc_eid|_hsenc|_hsmi|ref)$', re.I)
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+def normalize_url(url: str) -> str:
+    """Canonical form for dedup: lowercase host, no default port/fragment/tracking params, sorted query"""
+    parsed = urlparse(url.strip())
+    scheme = parsed.scheme.lower()
+    host = (parsed.hostname or '').lower()
+    if parsed.port and parsed.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parsed.port}"
+
+    path = re.sub(r'/{2,}', '/', parsed.path or '/')
+    if len(path) > 1:
+        path = path.rstrip('/')
+
+    query = sorted((k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True)
+                   if not TRACKING_PARAMS.match(k))
+    return urlunparse((scheme, host, path, '', urlencode(query), ''))
+
+def parse_sitemap(content: bytes) -> Tuple[List[str], List[str]]:
+    """Return (page URLs, nested sitemap URLs) from a sitemap or sitemap index, gzipped or not"""
+    if content[:2] == b'\x1f\x8b':
+        content = gzip.decompress(content)
+
+    root = ET.fromstring(content)
+    locs = [el.text.strip() for el in root.iter() if el.tag.endswith('loc') and el.text]
+    if root.tag.endswith('sitemapindex'):
+        return [], locs
+    return locs, []
+
+class CrawlFrontier:
+    """Priority queue of (priority, url, depth, kind) with bounded memory
+
+    Lower priority values are crawled first. At most `max_in_memory` entries
+    sit in a heap; the rest spill to SQLite. Everything on disk ranks at or
+    below everything in the heap, so pops stay globally ordered. Every URL
+    ever pushed is remembered (on disk) so nothing is queued twice.
+    """
+
+    def __init__(self, filename: str = "crawl_frontier.sqlite", max_in_memory: int = 10000,
+                 max_depth: int = 3, max_per_domain: Optional[int] = None, commit_every: int = 1000):
+        self.max_in_memory = max(2, max_in_memory)
+        self.commit_every = max(1, commit_every)
+        self._uncommitted = 0  # Rows written since the last commit
+        self.max_depth = max_depth
+        self.max_per_domain = max_per_domain
+        self.domain_counts: Dict[str, int] = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._disk_count = 0
+        self._disk_min = None  # Best priority currently on disk
+
+        self.db = sqlite3.connect(filename)
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS seen (url TEXT PRIMARY KEY)')
+            self.db.execute('''
+                CREATE TABLE IF NOT EXISTS queue (
+                    priority REAL NOT NULL, seq INTEGER NOT NULL,
+                    url TEXT NOT NULL, depth INTEGER NOT NULL, kind TEXT NOT NULL
+                )
+            ''')
+            self.db.execute('CREATE INDEX IF NOT EXISTS idx_queue_order ON queue (priority, seq)')
+
+        # Pick up entries left on disk by an earlier, interrupted crawl: new pushes rank after them
+        # within a priority, and per-domain budgets count the URLs it already queued
+        self._disk_count = self.db.execute('SELECT COUNT(*) FROM queue').fetchone()[0]
+        self._refresh_disk_min()
+        max_seq = self.db.execute('SELECT MAX(seq) FROM queue').fetchone()[0]
+        self._seq = itertools.count(max_seq + 1 if max_seq is not None else 0)
+        for (url,) in self.db.execute('SELECT url FROM seen'):
+            domain = urlparse(url).netloc
+            self.domain_counts[domain] = self.domain_counts.get(domain, 0) + 1
+        if self._disk_count:
+            print(f"📂 Resuming crawl frontier with {self._disk_count} queued URLs")
+
+    def __len__(self) -> int:
+        return len(self._heap) + self._disk_count
+
+    def push(self, url: str, priority: float = 0, depth: int = 0, kind: str = 'page') -> bool:
+        """Queue a URL unless it was seen before, is too deep or its domain is over budget"""
+        if depth > self.max_depth:
+            return False
+
+        url = normalize_url(url)
+        domain = urlparse(url).netloc
+        if self.max_per_domain is not None and self.domain_counts.get(domain, 0) >= self.max_per_domain:
+            return False
+
+        # Committed in batches (like spilled entries): heap entries only survive a clean close() anyway
+        if self.db.execute('INSERT OR IGNORE INTO seen VALUES (?)', (url,)).rowcount == 0:
+            return False
+        self._written(1)
+
+        self.domain_counts[domain] = self.domain_counts.get(domain, 0) + 1
+        self._enqueue((priority, next(self._seq), url, depth, kind))
+        return True
+
+    def requeue(self, url: str, priority: float = 0, depth: int = 0, kind: str = 'page'):
+        """Put back a popped URL that was never crawled (e.g. in flight when the crawl stopped)"""
+        self._enqueue((priority, next(self._seq), normalize_url(url), depth, kind))
+
+    def _enqueue(self, item):
+        priority = item[0]
+        # Keep the heap/disk ordering invariant: anything not better than the disk's best goes to disk,
+        # so a tie is ordered by seq behind the entries already there
+        if self._disk_count and priority >= self._disk_min:
+            self._spill([item])
+        else:
+            heapq.heappush(self._heap, item)
+            if len(self._heap) > self.max_in_memory:
+                self._spill_worst_half()
+
+    def pop(self) -> Optional[Tuple[str, int, str]]:
+        """Next (url, depth, kind) to crawl, or None when the frontier is empty"""
+        if not self._heap and self._disk_count:
+            self._refill()
+        if not self._heap:
+            return None
+        _, _, url, depth, kind = heapq.heappop(self._heap)
+        return url, depth, kind
+
+    def close(self):
+        """Persist in-memory entries so an interrupted crawl can resume"""
+        if self._heap:
+            self._spill(self._heap)
+            self._heap = []
+        self._commit()
+        self.db.close()
+
+    def finish(self):
+        """Crawl completed - forget queue and seen URLs so the next crawl starts fresh"""
+        with self.db:
+            self.db.execute('DELETE FROM queue')
+            self.db.execute('DELETE FROM seen')
+        self._heap = []
+        self._disk_count = 0
+        self._disk_min = None
+        self.db.close()
+
+    def _written(self, rows: int):
+        self._uncommitted += rows
+        if self._uncommitted >= self.commit_every:
+            self._commit()
+
+    def _commit(self):
+        self.db.commit()
+        self._uncommitted = 0
+
+    def _spill_worst_half(self):
+        self._heap.sort()
+        keep = len(self._heap) // 2
+        worst = self._heap[keep:]
+        self._heap = self._heap[:keep]
+        heapq.heapify(self._heap)
+        self._spill(worst)
+
+    def _spill(self, items):
+        self.db.executemany('INSERT INTO queue VALUES (?, ?, ?, ?, ?)', items)
+        self._written(len(items))
+        self._disk_count += len(items)
+        self._refresh_disk_min()
+
+    def _refill(self):
+        """Move the best entries from disk back into the heap"""
+        batch = self.max_in_memory // 2
+        rows = self.db.execute('SELECT rowid, priority, seq, url, depth, kind FROM queue '
+                               'ORDER BY priority, seq LIMIT ?', (batch,)).fetchall()
+        with self.db:
+            self.db.executemany('DELETE FROM queue WHERE rowid = ?', [(row[0],) for row in rows])
+        self._disk_count -= len(rows)
+        for row in rows:
+            heapq.heappush(self._heap, tuple(row[1:]))
+        self._refresh_disk_min()
+
+    def _refresh_disk_min(self):
+        row = self.db.execute('SELECT MIN(priority) FROM queue').fetchone()
+        self._disk_min = row[0] if row else None
@@ -0,0 +1,69 @@
+"""
+Document Store
+Full email documents in SQLite, keyed by vector id, so vector metadata only carries filterable fields
+"""
+
+import json
+import sqlite3
+import threading
+from typing import Dict, List
+
+class DocumentStore:
+    """Key-value store of email documents (subject, full body, metadata) with the last run that saw each
+
+    Ids are content-derived, so a stored document never changes: a sync
+    inserts new ids and re-marks existing ones, and a completed run removes
+    the ids it did not see.
+    """
+
+    def __init__(self, filename: str = "email_documents.sqlite"):
+        self.filename = filename
+        self._lock = threading.Lock()
+        # Shared across the app's script threads; every access holds the lock
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        with self.db:
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    id TEXT PRIMARY KEY,
+                    seen_run TEXT NOT NULL,
+                    document TEXT NOT NULL
+                )
+            """)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.db.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+
+    def put(self, documents: Dict[str, Dict], run_id: str):
+        """Store documents by id; ids already stored are only marked as seen"""
+        with self._lock, self.db:
+            self.db.executemany(
+                'INSERT INTO documents VALUES (?, ?, ?) ON CONFLICT (id) DO UPDATE SET seen_run = excluded.seen_run',
+                [(doc_id, run_id, json.dumps(document, ensure_ascii=False)) for doc_id, document in documents.items()]
+            )
+
+    def mark_seen(self, ids, run_id: str):
+        with self._lock, self.db:
+            self.db.executemany('UPDATE documents SET seen_run = ? WHERE id = ?', [(run_id, doc_id) for doc_id in ids])
+
+    def remove_unseen(self, run_id: str) -> int:
+        """Drop documents a completed run did not see"""
+        with self._lock, self.db:
+            return self.db.execute('DELETE FROM documents WHERE seen_run != ?', (run_id,)).rowcount
+
+    def get(self, ids: List[str]) -> Dict[str, Dict]:
+        """Documents for whichever ids are stored, in one batched lookup"""
+        found = {}
+        unique_ids = list(dict.fromkeys(ids))
+        with self._lock:
+            for i in range(0, len(unique_ids), 500):
+                chunk = unique_ids[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                for doc_id, document in self.db.execute(
+                        f'SELECT id, document FROM documents WHERE id IN ({placeholders})', chunk):
+                    found[doc_id] = json.loads(document)
+        return found
+
+    def clear(self):
+        with self._lock, self.db:
+            self.db.execute('DELETE FROM documents')
@@ -0,0 +1,127 @@
+"""
+Email Cleaning
+Fast text cleaning and feature flags for scraped emails, shared by the vector pipeline
+"""
+
+import re
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+CTA_PLACEHOLDER = re.compile(r'\[.*?\]')  # Keep CTA structure but simplify
+TEMPLATE_VARIABLE = re.compile(r'\{.*?\}')  # Remove variables like {name}
+
+# Feature vocabularies; FEATURE_PATTERNS below is the regex definition of each flag
+EMOJI_CHARS = '🎉🚀📧💎🌟✨🔥📱⚡️💰🎯'
+URGENCY_WORDS = ('urgent', 'limited', 'now', 'today', 'hurry', 'act fast', "don't miss")
+DISCOUNT_WORDS = ('discount', 'save', 'off', 'deal', 'free', 'promo')
+CTA_PHRASES = ('get started', 'learn more', 'sign up', 'download', 'try', 'buy')
+
+def _alternation(words: Tuple[str, ...]) -> str:
+    return '|'.join(re.escape(word) for word in words)
+
+FEATURE_PATTERNS = {
+    'has_emoji': f'[{EMOJI_CHARS}]',
+    'has_urgency': rf'\b(?:{_alternation(URGENCY_WORDS)})\b',
+    'has_discount': rf'\b(?:\d+%|{_alternation(DISCOUNT_WORDS)})\b',
+    'has_cta': rf'\[.*?\]|{_alternation(CTA_PHRASES)}',
+}
+FEATURE_REGEXES = {
+    name: re.compile(pattern, 0 if name == 'has_emoji' else re.IGNORECASE)
+    for name, pattern in FEATURE_PATTERNS.items()
+}
+PERCENTAGE = re.compile(r'\b\d+%\b')
+EMOJI_SET = frozenset(EMOJI_CHARS)
+# Non-ASCII letters that IGNORECASE matches against ASCII but str.lower() does not map to them
+CASEFOLD_EXCEPTIONS = frozenset('İıſK')
+
+def clean_text(text: str) -> str:
+    """Clean individual text content"""
+    if not isinstance(text, str):
+        return ""
+    # split/join is strip() + collapse of every \s run, without a regex pass
+    text = ' '.join(text.split())
+    if '[' in text:
+        text = CTA_PLACEHOLDER.sub('[CTA]', text)
+    if '{' in text:
+        text = TEMPLATE_VARIABLE.sub('', text)
+    return text
+
+def clean_texts(texts: List[str]) -> List[str]:
+    return [clean_text(text) for text in texts]
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == '_'
+
+def _has_bounded_word(text: str, words: Tuple[str, ...]) -> bool:
+    """Same as re.search(r'\\b(?:w1|w2|...)\\b', text) for words that start and end with word characters"""
+    end = len(text)
+    for word in words:
+        i = text.find(word)
+        while i != -1:
+            j = i + len(word)
+            if (i == 0 or not _is_word_char(text[i - 1])) and (j == end or not _is_word_char(text[j])):
+                return True
+            i = text.find(word, i + 1)
+    return False
+
+def row_flags(text: str) -> Tuple[bool, bool, bool, bool]:
+    """(has_emoji, has_urgency, has_discount, has_cta) for one text in a single pass
+
+    Substring searches on the lowercased text replace the case-insensitive
+    regexes; results are identical to FEATURE_REGEXES (texts where lowercasing
+    and IGNORECASE could disagree go through the regexes directly).
+    """
+    ascii_only = text.isascii()
+    if not ascii_only and not CASEFOLD_EXCEPTIONS.isdisjoint(text):
+        return tuple(bool(regex.search(text)) for regex in FEATURE_REGEXES.values())
+
+    lowered = text.lower()
+    has_emoji = not ascii_only and not EMOJI_SET.isdisjoint(text)
+    has_urgency = _has_bounded_word(lowered, URGENCY_WORDS)
+    has_discount = _has_bounded_word(lowered, DISCOUNT_WORDS) or ('%' in lowered and bool(PERCENTAGE.search(lowered)))
+    has_cta = any(phrase in lowered for phrase in CTA_PHRASES) \
+        or ('[' in lowered and bool(CTA_PLACEHOLDER.search(lowered)))
+    return has_emoji, has_urgency, has_discount, has_cta
+
+def feature_flags(texts: List[str]) -> Dict[str, np.ndarray]:
+    """All FEATURE_PATTERNS flags for each text, one scan per row"""
+    rows = [row_flags(text) for text in texts]
+    matrix = np.array(rows, dtype=bool).reshape(len(texts), len(FEATURE_PATTERNS))
+    return {name: matrix[:, column] for column, name in enumerate(FEATURE_PATTERNS)}
+
+def clean_email_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Cleaned subject/body, combined full_content, length metadata and feature flags"""
+    df['subject'] = clean_texts(df['subject'].fillna('').astype(str).tolist())
+    df['body'] = clean_texts(df['body'].fillna('').astype(str).tolist())
+
+    # Create combined content for embedding
+    full_content = [f"{subject} {body}" for subject, body in zip(df['subject'], df['body'])]
+    df['full_content'] = full_content
+
+    # Add useful metadata
+    df['subject_length'] = df['subject'].str.len()
+    df['body_length'] = df['body'].str.len()
+    df['word_count'] = [len(text.split()) for text in full_content]
+
+    # Extract features
+    for name, values in feature_flags(full_content).items():
+        df[name] = values
+
+    # Remove empty content
+    return df[[bool(text.strip()) for text in full_content]].copy()
+
+# Long bodies are embedded as overlapping sections (parent email id -> section ids)
+SECTION_WORDS = 200
+SECTION_OVERLAP_WORDS = 40
+# Section hits fetched per email wanted at query time, so several hits on one email still fill top_k
+SECTION_QUERY_FACTOR = 3
+
+def split_sections(text: str, max_words: int = SECTION_WORDS, overlap: int = SECTION_OVERLAP_WORDS) -> List[str]:
+    """Overlapping windows of at most max_words words; short texts come back whole"""
+    words = text.split()
+    if len(words) <= max_words:
+        return [text]
+    step = max(1, max_words - overlap)
+    return [' '.join(words[start:start + max_words]) for start in range(0, len(words) - overlap, step)]
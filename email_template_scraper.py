@@ -5,22 +5,655 @@ Downloads email templates from various sites including Spotmar alternatives
 """
 
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup, SoupStrainer
+from bs4.builder import builder_registry
+import soupsieve
 import json
 import time
 import os
+import csv
+import hashlib
+import threading
+import unicodedata
+import glob
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
 from urllib.parse import urljoin, urlparse
+from urllib.robotparser import RobotFileParser
 import re
-from typing import List, Dict
+from typing import Iterator, List, Dict, Optional, Tuple
 import pandas as pd
 
-class EmailTemplateScraper:
+from crawl_frontier import CrawlFrontier, parse_sitemap
+from http_cache import HttpCache
+
+# Polite per-host default: 2 requests/sec with bursts of 4; a robots.txt Crawl-delay slows a host further
+REQUESTS_PER_SECOND = 2.0
+REQUEST_BURST = 4
+
+class TokenBucketRateLimiter:
+    """Per-host token bucket shared by all crawl workers"""
+
+    def __init__(self, rate: float = REQUESTS_PER_SECOND, burst: int = REQUEST_BURST):
+        # rate = tokens (requests) per second per host, burst = bucket size
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._buckets = {}  # host -> (tokens, last_refill)
+        self._host_rates = {}  # host -> slower rate requested by robots.txt Crawl-delay
+        self._lock = threading.Lock()
+
+    def set_host_rate(self, host: str, rate: float):
+        """Slow down a single host (never speeds it up beyond the global rate) and stop it bursting"""
+        with self._lock:
+            self._host_rates[host] = min(self.rate, rate)
+
+    def acquire(self, host: str):
+        """Block until a request to `host` is allowed"""
+        while True:
+            with self._lock:
+                rate = self._host_rates.get(host, self.rate)
+                # A Crawl-delay is a gap between requests, so those hosts get no burst
+                burst = 1 if host in self._host_rates else self.burst
+                now = time.monotonic()
+                tokens, last = self._buckets.get(host, (float(burst), now))
+                tokens = min(float(burst), tokens + (now - last) * rate)
+
+                if tokens >= 1:
+                    self._buckets[host] = (tokens - 1, now)
+                    return
+
+                self._buckets[host] = (tokens, now)
+                wait = (1 - tokens) / rate
+
+            time.sleep(wait)
+
+class ScrapeMetrics:
+    """Per-source request/parse counters, printed in the summary and saved as JSON"""
+
+    LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
     def __init__(self):
+        self.sources = {}
+        self._lock = threading.Lock()
+
+    def _source(self, source: str) -> Dict:
+        if source not in self.sources:
+            self.sources[source] = {
+                'requests': 0,
+                'cache_hits': 0,
+                'errors': 0,
+                'bytes_downloaded': 0,
+                'status_codes': {},
+                'latency_ms_total': 0.0,
+                'latency_ms_max': 0.0,
+                'latency_ms_histogram': {f"<={b}": 0 for b in self.LATENCY_BUCKETS_MS} | {f">{self.LATENCY_BUCKETS_MS[-1]}": 0},
+                'pages_parsed': 0,
+                'parse_seconds_total': 0.0,
+                'records_extracted': 0,
+                'empty_pages': 0,
+            }
+        return self.sources[source]
+
+    def record_request(self, source: str, seconds: float, response: Optional[requests.Response] = None):
+        """One fetch attempt; response=None means it raised"""
+        latency_ms = seconds * 1000
+        bucket = next((f"<={b}" for b in self.LATENCY_BUCKETS_MS if latency_ms <= b),
+                      f">{self.LATENCY_BUCKETS_MS[-1]}")
+
+        with self._lock:
+            stats = self._source(source)
+            stats['requests'] += 1
+            stats['latency_ms_total'] += latency_ms
+            stats['latency_ms_max'] = max(stats['latency_ms_max'], latency_ms)
+            stats['latency_ms_histogram'][bucket] += 1
+
+            if response is None:
+                stats['errors'] += 1
+                return
+
+            status = str(response.status_code)
+            stats['status_codes'][status] = stats['status_codes'].get(status, 0) + 1
+            if getattr(response, 'from_cache', False):
+                stats['cache_hits'] += 1
+            else:
+                stats['bytes_downloaded'] += len(response.content)
+
+    def record_page(self, source: str, parse_seconds: float, records: int, bytes_read: int = 0):
+        """One parsed page; bytes_read covers sources read from disk rather than fetched"""
+        with self._lock:
+            stats = self._source(source)
+            stats['bytes_downloaded'] += bytes_read
+            stats['pages_parsed'] += 1
+            stats['parse_seconds_total'] += parse_seconds
+            stats['records_extracted'] += records
+            if records == 0:
+                stats['empty_pages'] += 1
+
+    def print_summary(self):
+        if not self.sources:
+            return
+
+        print("\nBy Source (crawl metrics):")
+        for source, stats in self.sources.items():
+            print(f"  • {source}:")
+            if stats['requests']:
+                mean_ms = stats['latency_ms_total'] / stats['requests']
+                codes = ', '.join(f"{code}×{n}" for code, n in sorted(stats['status_codes'].items()))
+                print(f"      requests: {stats['requests']} ({stats['cache_hits']} cached, {stats['errors']} errors) "
+                      f"- status {codes or 'n/a'}")
+                print(f"      latency: mean {mean_ms:.0f}ms, max {stats['latency_ms_max']:.0f}ms, "
+                      f"downloaded {stats['bytes_downloaded'] / 1024:.1f} KB")
+                histogram = ' '.join(f"{bucket}:{n}" for bucket, n in stats['latency_ms_histogram'].items() if n)
+                print(f"      latency histogram (ms): {histogram}")
+            if stats['pages_parsed']:
+                parse_ms = stats['parse_seconds_total'] / stats['pages_parsed'] * 1000
+                per_page = stats['records_extracted'] / stats['pages_parsed']
+                print(f"      parsed {stats['pages_parsed']} pages at {parse_ms:.1f}ms/page, "
+                      f"{per_page:.2f} records/page, {stats['empty_pages']} empty")
+
+    def save(self, filename: str = "scrape_metrics.json"):
+        with self._lock:
+            snapshot = {'generated_at': pd.Timestamp.now().isoformat(), 'sources': self.sources}
+            with open(filename, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, indent=2)
+        print(f"📈 Saved crawl metrics to {filename}")
+
+class CrawlState:
+    """On-disk record of visited URLs so re-runs are delta crawls and crashes can resume
+
+    Per URL we keep the content hash, ETag, Last-Modified and the last extracted
+    record. URLs already visited by an unfinished run are skipped outright; URLs
+    from a finished run are revalidated with a conditional GET.
+    """
+
+    def __init__(self, filename: str = "crawl_state.json", save_every: int = 25):
+        self.filename = filename
+        self.save_every = save_every
+        self._lock = threading.Lock()
+        self._dirty = 0
+        self.run = {}
+        self.urls = {}
+
+        if os.path.exists(filename):
+            try:
+                with open(filename, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+                self.run = state.get('run', {})
+                self.urls = state.get('urls', {})
+                print(f"📂 Loaded crawl state for {len(self.urls)} URLs from {filename}")
+            except (OSError, ValueError) as e:
+                print(f"⚠️  Ignoring unreadable crawl state {filename}: {e}")
+
+    def begin_run(self):
+        """Start a new run, or resume the previous one if it never finished"""
+        with self._lock:
+            if self.run and not self.run.get('finished', True):
+                print(f"⏯️  Resuming unfinished crawl started at {self.run['started_at']}")
+            else:
+                self.run = {'started_at': pd.Timestamp.now().isoformat(), 'finished': False}
+            self._save()
+
+    def finish_run(self):
+        """Mark the current run complete so the next one revalidates everything"""
+        with self._lock:
+            self.run['finished'] = True
+            self._save()
+
+    def get(self, url: str) -> Optional[Dict]:
+        with self._lock:
+            return self.urls.get(url)
+
+    def visited_this_run(self, url: str) -> bool:
+        entry = self.get(url)
+        return bool(entry and self.run and entry.get('run_started_at') == self.run.get('started_at'))
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        """If-None-Match / If-Modified-Since headers for a previously seen URL"""
+        entry = self.get(url) or {}
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def mark_visited(self, url: str, response: Optional[requests.Response] = None,
+                     content_hash: Optional[str] = None, record: Optional[Dict] = None):
+        """Record a visit; missing values are carried over from the previous entry"""
+        with self._lock:
+            entry = dict(self.urls.get(url, {}))
+            if response is not None and response.status_code != 304:
+                entry['etag'] = response.headers.get('ETag')
+                entry['last_modified'] = response.headers.get('Last-Modified')
+            if content_hash is not None:
+                entry['content_hash'] = content_hash
+            if record is not None:
+                entry['record'] = record
+            entry['visited_at'] = pd.Timestamp.now().isoformat()
+            entry['run_started_at'] = self.run.get('started_at')
+            self.urls[url] = entry
+
+            self._dirty += 1
+            if self._dirty >= self.save_every:
+                self._save()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        # Write-then-rename so a crash never leaves a half-written state file
+        tmp_file = f"{self.filename}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'run': self.run, 'urls': self.urls}, f, ensure_ascii=False)
+        os.replace(tmp_file, self.filename)
+        self._dirty = 0
+
+class JsonlSink:
+    """Append-only JSONL writer - each record hits disk shortly after it is scraped
+
+    The JSON array and CSV exports are streamed back out of the JSONL file,
+    so neither the writer nor the exports hold the whole corpus in memory.
+    """
+
+    def __init__(self, filename: str = "email_templates.jsonl", flush_every: int = 50, append: bool = False,
+                 dedup_index: Optional['DedupIndex'] = None):
+        self.filename = filename
+        self.flush_every = max(1, flush_every)
+        self.count = 0
+        self.dedup_index = dedup_index
+        self._buffer = []
+        self._pending_hashes = []  # Dedup hashes of buffered records, persisted only once those are on disk
+        self._lock = threading.Lock()
+        self._file = open(filename, 'a' if append else 'w', encoding='utf-8')
+
+    def write(self, record: Dict, dedup_hash: Optional[str] = None):
+        with self._lock:
+            self._buffer.append(json.dumps(record, ensure_ascii=False))
+            if dedup_hash:
+                self._pending_hashes.append(dedup_hash)
+            self.count += 1
+            if len(self._buffer) >= self.flush_every:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            self._file.write('\n'.join(self._buffer) + '\n')
+            self._buffer = []
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        # A crash before this line can only cause a re-scrape, never a record the index claims we have
+        if self._pending_hashes and self.dedup_index is not None:
+            self.dedup_index.persist(self._pending_hashes)
+        self._pending_hashes = []
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._file.close()
+
+    def iter_records(self):
+        """Yield records back from disk one at a time"""
+        self.flush()
+        with open(self.filename, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def export_json(self, filename: str) -> int:
+        """Stream the JSONL file out as a JSON array (same layout as json.dump(indent=2))"""
+        count = 0
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write('[')
+            for record in self.iter_records():
+                item = json.dumps(record, indent=2, ensure_ascii=False)
+                f.write((',\n' if count else '\n') + '  ' + item.replace('\n', '\n  '))
+                count += 1
+            f.write('\n]' if count else ']')
+        return count
+
+    def export_csv(self, filename: str) -> int:
+        """Stream the JSONL file out as CSV; a first pass collects the column union"""
+        fieldnames = {}
+        for record in self.iter_records():
+            fieldnames.update(dict.fromkeys(record))
+
+        count = 0
+        with open(filename, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(fieldnames))
+            writer.writeheader()
+            for record in self.iter_records():
+                writer.writerow(record)
+                count += 1
+        return count
+
+class DedupIndex:
+    """Persistent set of normalized subject+body hashes for records already kept
+
+    Hashes are appended to a plain text file, so the index survives crashes
+    and re-runs. Pair it with an appending JsonlSink: the index describes what
+    that file already holds, so reserve() a record's hash and let the sink
+    persist() it once the record itself is fsynced.
+    """
+
+    def __init__(self, filename: str = "dedup_index.txt"):
+        self.filename = filename
+        self.hashes = set()
+        self._lock = threading.Lock()
+
+        if os.path.exists(filename):
+            with open(filename, 'r', encoding='utf-8') as f:
+                self.hashes.update(line.strip() for line in f if line.strip())
+            print(f"📂 Loaded {len(self.hashes)} known template hashes from {filename}")
+
+        self._file = open(filename, 'a', encoding='utf-8')
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        text = unicodedata.normalize('NFKC', str(text or ''))
+        return re.sub(r'\s+', ' ', text).strip().lower()
+
+    @classmethod
+    def content_hash(cls, record: Dict) -> str:
+        key = cls.normalize(record.get('subject')) + '\x1f' + cls.normalize(record.get('body'))
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def reserve(self, record: Dict) -> Optional[str]:
+        """Claim the record's hash for this run (not yet on disk); None if an equivalent one was seen before"""
+        digest = self.content_hash(record)
+        with self._lock:
+            if digest in self.hashes:
+                return None
+            self.hashes.add(digest)
+            return digest
+
+    def persist(self, digests: List[str]):
+        """Write reserved hashes whose records are now durable"""
+        with self._lock:
+            self._file.write(''.join(digest + '\n' for digest in digests))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def add(self, record: Dict) -> bool:
+        """Remember the record at once; False if an equivalent one was seen before"""
+        digest = self.reserve(record)
+        if digest is None:
+            return False
+        self.persist([digest])
+        return True
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+# Parser for bulk extraction - lxml is several times faster than html.parser
+FAST_PARSER = 'lxml' if builder_registry.lookup('lxml') else 'html.parser'
+
+RGE_SOURCE = 'really_good_emails'
+RGE_CATEGORY_URL = "https://reallygoodemails.com/emails/announcement"
+RGE_SITEMAP_URL = "https://reallygoodemails.com/sitemap.xml"
+
+# Frontier priorities - finish known email pages before discovering more listings
+PRIORITY_EMAIL = 0
+PRIORITY_LISTING = 1
+PAGINATION_LINK = re.compile(r'[?&]page=\d+')
+
+# Selector fallbacks per field for Really Good Emails pages
+RGE_SELECTORS = {
+    'subject': ['h1', '.email-subject', '[data-subject]', '.subject'],
+    'body': ['.email-body', '.email-content', '.content', 'main'],
+    'brand': ['.brand', '.company', '.sender'],
+}
+
+class SelectorStrainer(SoupStrainer):
+    """Keep only subtrees rooted at tags a list of simple selectors can match
+
+    Understands `tag`, `.class` and `[attr]` selectors. Works with both the
+    bs4 < 4.13 (search_tag) and bs4 >= 4.13 (allow_tag_creation) parse hooks.
+    """
+
+    SIMPLE_SELECTOR = re.compile(r'^(?:(?P<tag>[a-zA-Z][\w-]*)|\.(?P<cls>[\w-]+)|\[(?P<attr>[\w-]+)\])$')
+
+    def __init__(self, selectors: List[str]):
+        super().__init__()
+        self.tags, self.classes, self.attrs = set(), set(), set()
+
+        for selector in selectors:
+            match = self.SIMPLE_SELECTOR.match(selector.strip())
+            if not match:
+                raise ValueError(f"Selector too complex to strain on: {selector!r}")
+            if match.group('tag'):
+                self.tags.add(match.group('tag').lower())
+            elif match.group('cls'):
+                self.classes.add(match.group('cls'))
+            else:
+                self.attrs.add(match.group('attr'))
+
+    def wanted(self, name, attrs) -> bool:
+        if name in self.tags:
+            return True
+        attrs = attrs or {}
+        if self.attrs.intersection(attrs):
+            return True
+        classes = attrs.get('class') or []
+        if isinstance(classes, str):
+            classes = classes.split()
+        return bool(self.classes.intersection(classes))
+
+    # bs4 >= 4.13
+    def allow_tag_creation(self, nsprefix, name, attrs) -> bool:
+        return self.wanted(name, attrs)
+
+    def allow_string_creation(self, string) -> bool:
+        return False
+
+    # bs4 < 4.13
+    def search_tag(self, markup_name=None, markup_attrs={}):
+        return self.wanted(markup_name, markup_attrs)
+
+class HtmlExtractor:
+    """Field extractor for one source: selectors compiled once, lxml + strained parse"""
+
+    def __init__(self, fields: Dict[str, List[str]], parser: str = FAST_PARSER):
+        self.parser = parser
+        self.fields = {
+            name: [soupsieve.compile(selector) for selector in selectors]
+            for name, selectors in fields.items()
+        }
+
+        all_selectors = [selector for selectors in fields.values() for selector in selectors]
+        try:
+            self.strainer = SelectorStrainer(all_selectors)
+        except ValueError:
+            self.strainer = None  # Combinators need the full tree
+
+    def parse(self, content) -> BeautifulSoup:
+        return BeautifulSoup(content, self.parser, parse_only=self.strainer)
+
+    def extract(self, content) -> Dict[str, str]:
+        """Parse a page once and return the first non-empty text for every field"""
+        soup = self.parse(content)
+        result = {}
+
+        for name, selectors in self.fields.items():
+            result[name] = ""
+            for selector in selectors:
+                element = selector.select_one(soup)
+                if element is not None:
+                    text = element.get_text().strip()
+                    if text:
+                        result[name] = text
+                        break
+
+        return result
+
+# Outlook-only conditional blocks, and the markers around "downlevel-revealed" ones
+MSO_CONDITIONAL = re.compile(r'<!--\[if[^\]]*\]>(?!<!-->).*?<!\[endif\]-->', re.S | re.I)
+MSO_MARKERS = re.compile(r'<!--\[if[^\]]*\]><!-->|<!--<!\[endif\]-->', re.I)
+# Preheader padding ESPs use to push preview text out of the inbox snippet
+INVISIBLE_CHARS = re.compile('[\u034f\u00ad\u200b\u200c\u200d\u2060\ufeff]')
+CTA_EXCLUDE = re.compile(r'unsubscribe|view (it )?(in|on) (your )?browser|privacy|preferences|manage|terms', re.I)
+
+def parse_local_template(path: str) -> Optional[Dict]:
+    """Turn one exported HTML email into a scraper record (module level so worker processes can pickle it)"""
+    try:
+        with open(path, 'rb') as f:
+            html = f.read().decode('utf-8', errors='replace')
+
+        html = MSO_MARKERS.sub('', MSO_CONDITIONAL.sub('', html))
+        soup = BeautifulSoup(html, FAST_PARSER)
+
+        title = soup.title.get_text().strip() if soup.title else ''
+        for tag in soup(['head', 'style', 'script', 'noscript']):
+            tag.decompose()
+
+        # Image-heavy emails carry their copy in alt text
+        for img in soup.find_all('img'):
+            alt = (img.get('alt') or '').strip()
+            if alt:
+                img.replace_with(f"\n{alt}\n")
+            else:
+                img.decompose()
+
+        # Short link texts are buttons/CTAs - mark them the way curated templates do
+        for link in soup.find_all('a'):
+            text = ' '.join(link.get_text().split())
+            if text and len(text) <= 40 and not CTA_EXCLUDE.search(text):
+                link.string = f"[{text}]"
+
+        lines = []
+        for line in INVISIBLE_CHARS.sub('', soup.get_text('\n')).splitlines():
+            line = ' '.join(line.split())
+            if line:
+                lines.append(line)
+        body = '\n'.join(lines)
+
+        if not body:
+            return None
+
+        # Exports rarely keep the subject; the preheader (first plain text line) is the closest thing
+        # and <title> is usually the brand
+        preheader = next((line for line in lines if not line.startswith('[') and not CTA_EXCLUDE.search(line)), '')
+        subject = preheader[:150] or title
+        stem = Path(path).stem
+        subject = subject or stem
+
+        return {
+            'source': 'local_template',
+            'source_url': Path(path).resolve().as_uri(),
+            'subject': subject,
+            'body': body,
+            'brand': title,
+            'category': re.sub(r'[_-]?\d+$', '', stem) or stem,
+            'scraped_at': pd.Timestamp.now().isoformat()
+        }
+
+    except Exception as e:
+        print(f"❌ Error parsing {path}: {e}")
+        return None
+
+def timed_parse_local_template(path: str) -> Tuple[Optional[Dict], float, int]:
+    """parse_local_template plus (parse seconds, file size) for the crawl metrics"""
+    start = time.perf_counter()
+    record = parse_local_template(path)
+    return record, time.perf_counter() - start, os.path.getsize(path)
+
+class EmailTemplateScraper:
+    def __init__(self, max_workers: int = 4, requests_per_second: float = REQUESTS_PER_SECOND, burst: int = REQUEST_BURST,
+                 state_file: Optional[str] = None, sink_file: Optional[str] = None,
+                 keep_in_memory: bool = True, dedup_file: Optional[str] = None,
+                 cache: Optional[HttpCache] = None):
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
         })
+        self.max_workers = max(1, max_workers)
+
+        # One pooled connection per worker so threads don't fight over sockets
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.rate_limiter = TokenBucketRateLimiter(requests_per_second, burst)
+        self.rge_extractor = HtmlExtractor(RGE_SELECTORS)
+        self.cache = cache
+        self._robots = {}  # host -> RobotFileParser (None when robots.txt is unreachable)
+        self.metrics = ScrapeMetrics()
+        self.crawl_state = CrawlState(state_file) if state_file else None
+        # A persistent dedup index means earlier runs' records live in the sink, so append to it
+        self.dedup_index = DedupIndex(dedup_file) if dedup_file else None
+        self.sink = JsonlSink(sink_file, append=self.dedup_index is not None,
+                              dedup_index=self.dedup_index) if sink_file else None
+
+        # With a sink, bulk crawls can drop the in-memory list entirely
+        self.keep_in_memory = keep_in_memory or self.sink is None
         self.emails = []
+        self.email_count = 0
+        self.duplicate_count = 0
+        self.source_counts = {}
+        self.category_counts = {}
+        self._seen_hashes = set()  # In-run dedup when no persistent index is configured
+
+    def add_email(self, email_data: Dict) -> bool:
+        """Single entry point for scraped records: dedup, stream to the sink, count, optionally keep"""
+        digest = None
+        if self.dedup_index and self.sink:
+            # The sink persists the hash after the record itself reaches disk
+            digest = self.dedup_index.reserve(email_data)
+            is_new = digest is not None
+        elif self.dedup_index:
+            is_new = self.dedup_index.add(email_data)
+        else:
+            digest = DedupIndex.content_hash(email_data)
+            is_new = digest not in self._seen_hashes
+            self._seen_hashes.add(digest)
+
+        if not is_new:
+            self.duplicate_count += 1
+            return False
+
+        if self.sink:
+            self.sink.write(email_data, digest)
+        if self.keep_in_memory:
+            self.emails.append(email_data)
+
+        self.email_count += 1
+        source = email_data.get('source', 'unknown')
+        category = email_data.get('category', 'unknown')
+        self.source_counts[source] = self.source_counts.get(source, 0) + 1
+        self.category_counts[category] = self.category_counts.get(category, 0) + 1
+        return True
+
+    def fetch(self, url: str, source: Optional[str] = None, **kwargs) -> requests.Response:
+        """GET a URL through the shared session, respecting the per-host rate limit
+
+        With a response cache, fresh hits never touch the network or the rate limiter.
+        Timings are recorded under `source` (the URL's host if not given).
+        """
+        kwargs.setdefault('timeout', 10)
+        source = source or urlparse(url).netloc
+        start = time.perf_counter()
+        response = None
+
+        try:
+            if self.cache:
+                response = self.cache.get(url, self.session.get, before_send=self._wait_for_slot, **kwargs)
+            else:
+                self._wait_for_slot(url)
+                response = self.session.get(url, **kwargs)
+            return response
+        finally:
+            self.metrics.record_request(source, time.perf_counter() - start, response)
+
+    def _wait_for_slot(self, url: str):
+        self.rate_limiter.acquire(urlparse(url).netloc)
     
     def scrape_spotmar_alternative_sources(self):
         """Scrape from alternative sources since Spotmar requires login"""
@@ -37,15 +670,14 @@ class EmailTemplateScraper:
         
         return self.emails
     
-    def scrape_really_good_emails(self):
+    def scrape_really_good_emails(self, limit: int = 5, url: str = RGE_CATEGORY_URL):
         """Scrape from Really Good Emails - they have free examples"""
         print("📧 Attempting Really Good Emails...")
         
         try:
             # Get the main page with email categories
-            url = "https://reallygoodemails.com/emails/announcement"
             print(f"🔗 Trying URL: {url}")
-            response = self.session.get(url, timeout=10)
+            response = self.fetch(url, source=RGE_SOURCE)
             
             print(f"📊 Response status: {response.status_code}")
             
@@ -68,50 +700,244 @@ class EmailTemplateScraper:
                 print("🔍 Skipping Really Good Emails for now...")
                 return
             
-            count = 0
-            for link in email_links[:5]:  # Reduce to 5 for testing
-                if count >= 5:
-                    break
-                    
-                email_url = urljoin(url, link.get('href'))
-                print(f"🔗 Trying to scrape: {email_url}")
-                email_data = self.scrape_single_email_rge(email_url)
-                
-                if email_data:
-                    self.emails.append(email_data)
-                    count += 1
-                    print(f"✅ Scraped email {count}: {email_data['subject'][:50]}...")
-                else:
-                    print(f"❌ Failed to extract data from {email_url}")
-                
-                time.sleep(2)  # Be respectful
+            # Dedupe links while keeping page order
+            email_urls = list(dict.fromkeys(urljoin(url, link.get('href')) for link in email_links))
+            email_urls = email_urls[:limit]  # Keep small while testing
+
+            if self.crawl_state:
+                self.crawl_state.begin_run()
+
+            count = self.scrape_urls_concurrently(email_urls, self.scrape_single_email_rge)
+            print(f"📧 Scraped {count}/{len(email_urls)} Really Good Emails pages")
+
+            if self.crawl_state:
+                self.crawl_state.finish_run()
                 
         except Exception as e:
+            if self.crawl_state:
+                self.crawl_state.save()  # Keep progress so the next run can resume
             print(f"❌ Error scraping Really Good Emails: {e}")
             print(f"❌ Exception type: {type(e).__name__}")
             print("ℹ️  Continuing with other sources...")
     
-    def scrape_single_email_rge(self, url: str) -> Dict:
+    def scrape_urls_concurrently(self, urls: List[str], scrape_fn) -> int:
+        """Run scrape_fn over urls with up to max_workers pages in flight"""
+        count = 0
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {}
+            for email_url in urls:
+                print(f"🔗 Trying to scrape: {email_url}")
+                futures[executor.submit(scrape_fn, email_url)] = email_url
+
+            # Only the main thread adds records
+            for future in as_completed(futures):
+                email_url = futures[future]
+                email_data = future.result()
+
+                if email_data and self.add_email(email_data):
+                    count += 1
+                    print(f"✅ Scraped email {count}: {email_data['subject'][:50]}...")
+                elif email_data:
+                    print(f"♻️  Duplicate template skipped: {email_url}")
+                else:
+                    print(f"❌ Failed to extract data from {email_url}")
+
+        return count
+
+    def crawl_really_good_emails(self, max_pages: int = 500, max_depth: int = 3,
+                                 category_urls: Optional[List[str]] = None,
+                                 sitemap_url: Optional[str] = RGE_SITEMAP_URL,
+                                 frontier_file: str = "crawl_frontier.sqlite",
+                                 max_in_memory: int = 10000) -> int:
+        """Frontier-driven crawl: sitemap + category pagination discovery, depth-limited, robots-aware"""
+        print(f"🕸️  Crawling Really Good Emails (up to {max_pages} pages, depth {max_depth})...")
+
+        frontier = CrawlFrontier(frontier_file, max_in_memory=max_in_memory, max_depth=max_depth)
+
+        for category_url in category_urls or [RGE_CATEGORY_URL]:
+            self._push_if_allowed(frontier, category_url, PRIORITY_LISTING, 0, 'listing')
+        if sitemap_url:
+            for email_url in self.discover_sitemap_urls(sitemap_url):
+                self._push_if_allowed(frontier, email_url, PRIORITY_EMAIL, 0, 'email')
+
+        if self.crawl_state:
+            self.crawl_state.begin_run()
+
+        pages = count = 0
+        in_flight = {}
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                while pages < max_pages and (len(frontier) or in_flight):
+                    # Keep up to max_workers pages in flight, never past the page budget
+                    while len(in_flight) < self.max_workers and pages + len(in_flight) < max_pages:
+                        item = frontier.pop()
+                        if item is None:
+                            break
+                        in_flight[executor.submit(self._crawl_page, *item)] = item
+
+                    if not in_flight:
+                        break
+
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        url, depth, _ = in_flight.pop(future)
+                        pages += 1
+                        email_data, links = future.result()
+
+                        if email_data and self.add_email(email_data):
+                            count += 1
+                            print(f"✅ Scraped email {count}: {email_data['subject'][:50]}...")
+
+                        for link, priority, kind in links:
+                            self._push_if_allowed(frontier, link, priority, depth + 1, kind)
+
+        except BaseException:
+            # Pages still in flight were popped but never crawled: queue them again for the next run
+            for url, depth, kind in in_flight.values():
+                frontier.requeue(url, PRIORITY_LISTING if kind == 'listing' else PRIORITY_EMAIL, depth, kind)
+            frontier.close()  # Leave the queue on disk so the next run resumes
+            if self.crawl_state:
+                self.crawl_state.save()
+            raise
+
+        if len(frontier):
+            frontier.close()  # Page budget hit - the remainder is picked up next run
+        else:
+            frontier.finish()
+        if self.crawl_state:
+            self.crawl_state.finish_run()
+
+        print(f"🕸️  Crawled {pages} pages, added {count} templates, {len(frontier)} URLs left in frontier")
+        return count
+
+    def _crawl_page(self, url: str, depth: int, kind: str) -> Tuple[Optional[Dict], List[Tuple[str, int, str]]]:
+        """Worker: scrape an email page, or pull email and pagination links out of a listing page"""
+        if kind == 'email':
+            return self.scrape_single_email_rge(url), []
+
+        try:
+            response = self.fetch(url, source=RGE_SOURCE)
+            if response.status_code != 200:
+                print(f"❌ Listing {url} returned {response.status_code}")
+                return None, []
+
+            soup = BeautifulSoup(response.content, FAST_PARSER, parse_only=SoupStrainer('a'))
+            host = urlparse(url).netloc
+            links = []
+            for link in soup.find_all('a', href=True):
+                link_url = urljoin(url, link['href'])
+                if urlparse(link_url).netloc != host:
+                    continue
+                if PAGINATION_LINK.search(link_url) or 'next' in (link.get('rel') or []):
+                    links.append((link_url, PRIORITY_LISTING, 'listing'))
+                elif '/emails/' in link_url:
+                    links.append((link_url, PRIORITY_EMAIL, 'email'))
+            return None, links
+
+        except Exception as e:
+            print(f"❌ Error crawling listing {url}: {e}")
+            return None, []
+
+    def discover_sitemap_urls(self, sitemap_url: str, max_sitemaps: int = 50,
+                              source: str = RGE_SOURCE) -> Iterator[str]:
+        """Email page URLs from a sitemap (following sitemap indexes), yielded as each sitemap is read
+        
+        Only the sitemap being read is held in memory; the caller pushes each
+        URL into the frontier, which spills to disk.
+        """
+        pending = [sitemap_url]
+        fetched = found = 0
+
+        while pending and fetched < max_sitemaps:
+            current = pending.pop(0)
+            fetched += 1
+            try:
+                response = self.fetch(current, source=source)
+                if response.status_code != 200:
+                    print(f"⚠️  Sitemap {current} returned {response.status_code}")
+                    continue
+                page_urls, nested = parse_sitemap(response.content)
+            except Exception as e:
+                print(f"⚠️  Could not read sitemap {current}: {e}")
+                continue
+            pending.extend(nested)
+            for url in page_urls:
+                if '/emails/' in url:
+                    found += 1
+                    yield url
+
+        print(f"🗺️  Sitemap discovery found {found} email URLs")
+
+    def allowed_by_robots(self, url: str) -> bool:
+        """Check robots.txt (fetched once per host); Crawl-delay slows that host's rate limit"""
+        parsed = urlparse(url)
+        host = parsed.netloc
+
+        if host not in self._robots:
+            robots = None
+            try:
+                response = self.fetch(f"{parsed.scheme}://{host}/robots.txt")
+                if response.status_code == 200:
+                    robots = RobotFileParser()
+                    robots.parse(response.text.splitlines())
+                    delay = robots.crawl_delay(self.session.headers['User-Agent'])
+                    if delay:
+                        self.rate_limiter.set_host_rate(host, 1.0 / float(delay))
+            except Exception as e:
+                print(f"⚠️  Could not read robots.txt for {host}: {e}")
+            self._robots[host] = robots
+
+        robots = self._robots[host]
+        return robots is None or robots.can_fetch(self.session.headers['User-Agent'], url)
+
+    def _push_if_allowed(self, frontier: CrawlFrontier, url: str, priority: int, depth: int, kind: str):
+        if self.allowed_by_robots(url):
+            frontier.push(url, priority, depth, kind)
+
+    def scrape_single_email_rge(self, url: str) -> Optional[Dict]:
         """Scrape a single email from Really Good Emails"""
         try:
-            response = self.session.get(url, timeout=10)
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # Extract email content (adjust selectors as needed)
-            subject = self.extract_text(soup, [
-                'h1', '.email-subject', '[data-subject]', '.subject'
-            ])
-            
-            body = self.extract_text(soup, [
-                '.email-body', '.email-content', '.content', 'main'
-            ])
+            entry = self.crawl_state.get(url) if self.crawl_state else None
+            cached_record = entry.get('record') if entry else None
+
+            # Already handled by the run we are resuming - no request needed
+            if cached_record and self.crawl_state.visited_this_run(url):
+                return cached_record
+
+            headers = self.crawl_state.conditional_headers(url) if self.crawl_state else {}
+            response = self.fetch(url, source=RGE_SOURCE, headers=headers)
+
+            if response.status_code == 304 and cached_record:
+                print(f"♻️  Unchanged: {url}")
+                self.crawl_state.mark_visited(url, response)
+                return cached_record
+
+            if response.status_code != 200:
+                print(f"❌ {url} returned {response.status_code}")
+                return None
+
+            # Server ignored the validators but the page is byte-identical
+            content_hash = hashlib.sha256(response.content).hexdigest()
+            if cached_record and entry.get('content_hash') == content_hash:
+                self.crawl_state.mark_visited(url, response, content_hash)
+                return cached_record
+
+            # Extract email content (adjust selectors in RGE_SELECTORS as needed)
+            parse_start = time.perf_counter()
+            fields = self.rge_extractor.extract(response.content)
+            self.metrics.record_page(RGE_SOURCE, time.perf_counter() - parse_start,
+                                     1 if fields['subject'] or fields['body'] else 0)
+            subject = fields['subject']
+            body = fields['body']
             
             # Get metadata
-            brand = self.extract_text(soup, ['.brand', '.company', '.sender'])
+            brand = fields['brand']
             category = "announcement"
             
-            return {
-                'source': 'really_good_emails',
+            record = {
+                'source': RGE_SOURCE,
                 'source_url': url,
                 'subject': subject,
                 'body': body,
@@ -119,6 +945,11 @@ class EmailTemplateScraper:
                 'category': category,
                 'scraped_at': pd.Timestamp.now().isoformat()
             }
+
+            if self.crawl_state and response.status_code == 200:
+                self.crawl_state.mark_visited(url, response, content_hash, record)
+
+            return record
             
         except Exception as e:
             print(f"❌ Error scraping {url}: {e}")
@@ -209,8 +1040,10 @@ P.S. Keep an eye on your inbox for exclusive early access to our upcoming featur
                 'category': template['category'],
                 'scraped_at': pd.Timestamp.now().isoformat()
             }
-            self.emails.append(email_data)
-            print(f"✅ Added template: {template['subject'][:50]}...")
+            if self.add_email(email_data):
+                print(f"✅ Added template: {template['subject'][:50]}...")
+            else:
+                print(f"♻️  Already have: {template['subject'][:50]}...")
     
     def scrape_email_design_sites(self):
         """Scrape from email design inspiration sites"""
@@ -358,8 +1191,10 @@ With gratitude,
                 'category': template['category'],
                 'scraped_at': pd.Timestamp.now().isoformat()
             }
-            self.emails.append(email_data)
-            print(f"✅ Added design template: {template['subject'][:50]}...")
+            if self.add_email(email_data):
+                print(f"✅ Added design template: {template['subject'][:50]}...")
+            else:
+                print(f"♻️  Already have: {template['subject'][:50]}...")
     
     def scrape_hubspot_examples(self):
         """Add HubSpot-style announcement templates"""
@@ -435,64 +1270,101 @@ Thanks for being with us!
                 'category': template['category'],
                 'scraped_at': pd.Timestamp.now().isoformat()
             }
-            self.emails.append(email_data)
-            print(f"✅ Added HubSpot-style: {template['subject'][:50]}...")
-    
-    def extract_text(self, soup, selectors: List[str]) -> str:
-        """Extract text using multiple selector fallbacks"""
-        for selector in selectors:
-            element = soup.select_one(selector)
-            if element and element.get_text().strip():
-                return element.get_text().strip()
-        return ""
+            if self.add_email(email_data):
+                print(f"✅ Added HubSpot-style: {template['subject'][:50]}...")
+            else:
+                print(f"♻️  Already have: {template['subject'][:50]}...")
     
+    def scrape_local_templates(self, directory: str = "templates", processes: Optional[int] = None,
+                               chunksize: int = 16) -> int:
+        """Parse exported HTML emails (ESP/MJML exports) from a local directory in a process pool"""
+        print(f"🗂️  Parsing local templates from {directory}/...")
+
+        paths = sorted(glob.glob(os.path.join(directory, '**', '*.htm*'), recursive=True))
+        if not paths:
+            print(f"⚠️  No HTML files found in {directory}")
+            return 0
+
+        count = 0
+        start = time.perf_counter()
+
+        if processes == 1 or len(paths) == 1:
+            records = map(timed_parse_local_template, paths)
+            count = self._add_local_records(records)
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                records = executor.map(timed_parse_local_template, paths, chunksize=chunksize)
+                count = self._add_local_records(records)
+
+        elapsed = time.perf_counter() - start
+        print(f"✅ Parsed {len(paths)} files, added {count} templates in {elapsed:.1f}s")
+        return count
+
+    def _add_local_records(self, results) -> int:
+        count = 0
+        for email_data, parse_seconds, size in results:
+            self.metrics.record_page('local_template', parse_seconds, 1 if email_data else 0, size)
+            if email_data and self.add_email(email_data):
+                count += 1
+        return count
+
     def save_templates(self, filename: str = "email_templates.json"):
         """Save scraped templates to JSON file"""
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(self.emails, f, indent=2, ensure_ascii=False)
+        if self.sink:
+            count = self.sink.export_json(filename)
+        else:
+            with open(filename, 'w', encoding='utf-8') as f:
+                json.dump(self.emails, f, indent=2, ensure_ascii=False)
+            count = len(self.emails)
         
-        print(f"💾 Saved {len(self.emails)} templates to {filename}")
+        print(f"💾 Saved {count} templates to {filename}")
     
     def save_as_csv(self, filename: str = "email_templates.csv"):
         """Save templates as CSV for easy processing"""
-        df = pd.DataFrame(self.emails)
-        df.to_csv(filename, index=False)
-        print(f"📊 Saved {len(self.emails)} templates to {filename}")
+        if self.sink:
+            count = self.sink.export_csv(filename)
+        else:
+            df = pd.DataFrame(self.emails)
+            df.to_csv(filename, index=False)
+            count = len(self.emails)
+        print(f"📊 Saved {count} templates to {filename}")
     
     def get_summary(self):
         """Print summary of scraped templates"""
-        if not self.emails:
+        if not self.email_count:
             print("❌ No templates found!")
+            self.metrics.print_summary()  # Shows which source came back empty
             return
         
         print(f"\n📈 SCRAPING SUMMARY:")
-        print(f"Total templates: {len(self.emails)}")
-        
-        # Group by source
-        sources = {}
-        categories = {}
-        
-        for email in self.emails:
-            source = email.get('source', 'unknown')
-            category = email.get('category', 'unknown')
-            
-            sources[source] = sources.get(source, 0) + 1
-            categories[category] = categories.get(category, 0) + 1
+        print(f"Total templates: {self.email_count}")
+        if self.duplicate_count:
+            print(f"Duplicates skipped: {self.duplicate_count}")
         
         print(f"\nBy Source:")
-        for source, count in sources.items():
+        for source, count in self.source_counts.items():
             print(f"  • {source}: {count} templates")
         
         print(f"\nBy Category:")
-        for category, count in categories.items():
+        for category, count in self.category_counts.items():
             print(f"  • {category}: {count} templates")
 
-def main():
-    """Main function to run the scraper"""
+        self.metrics.print_summary()
+
+def main(requests_per_second: float = REQUESTS_PER_SECOND, burst: int = REQUEST_BURST):
+    """Main function to run the scraper (requests_per_second and burst are per host)"""
     print("🚀 STARTING EMAIL TEMPLATE SCRAPER")
     print("=" * 50)
+    print(f"🚦 Rate limit: {requests_per_second:g} requests/sec per host, bursts of {burst} (robots.txt Crawl-delay wins)")
     
-    scraper = EmailTemplateScraper()
+    scraper = EmailTemplateScraper(
+        requests_per_second=requests_per_second,
+        burst=burst,
+        state_file="crawl_state.json",
+        sink_file="email_templates.jsonl",
+        dedup_file="dedup_index.txt",
+        cache=HttpCache(".http_cache")
+    )
     
     # Since Spotmar requires login, use alternative sources
     print("ℹ️  Note: Spotmar requires account access, using alternative sources...")
@@ -514,13 +1386,22 @@ def main():
     print(f"   Templates so far: {len(scraper.emails)}")
     print()
     
-    print("4️⃣ Attempting to scrape Really Good Emails...")
-    scraper.scrape_really_good_emails()
+    print("4️⃣ Attempting to crawl Really Good Emails...")
+    scraper.crawl_really_good_emails(max_pages=50)
+    print(f"   Templates so far: {len(scraper.emails)}")
+    print()
+
+    print("5️⃣ Parsing local template exports...")
+    scraper.scrape_local_templates("templates")
     print(f"   Final template count: {len(scraper.emails)}")
     print()
     
+    if scraper.duplicate_count:
+        print(f"   Duplicates skipped (already in corpus): {scraper.duplicate_count}")
+        print()
+
     # Check if we have any templates
-    if len(scraper.emails) == 0:
+    if scraper.email_count == 0 and scraper.duplicate_count == 0:
         print("❌ ERROR: No templates were created!")
         print("🔍 Let's debug...")
         
@@ -534,7 +1415,7 @@ def main():
             'category': 'test',
             'scraped_at': pd.Timestamp.now().isoformat()
         }
-        scraper.emails.append(test_email)
+        scraper.add_email(test_email)
         print(f"✅ Added test email. Total: {len(scraper.emails)}")
     
     # Save results
@@ -542,6 +1423,8 @@ def main():
         print("💾 Saving files...")
         scraper.save_templates()
         scraper.save_as_csv()
+        scraper.sink.close()
+        scraper.dedup_index.close()
         print("✅ Files saved successfully!")
     except Exception as e:
         print(f"❌ Error saving files: {e}")
@@ -549,6 +1432,7 @@ def main():
     
     # Print summary
     scraper.get_summary()
+    scraper.metrics.save("scrape_metrics.json")
     
     # Show first few templates for verification
     if scraper.emails:
@@ -561,6 +1445,11 @@ def main():
     
     print("\n✅ SCRAPING COMPLETE!")
     print("Files created:")
+    if os.path.exists("email_templates.jsonl"):
+        print("  ✅ email_templates.jsonl")
+    else:
+        print("  ❌ email_templates.jsonl - FILE NOT CREATED!")
+
     if os.path.exists("email_templates.json"):
         print("  ✅ email_templates.json")
     else:
@@ -0,0 +1,100 @@
+"""
+Embedders
+Pluggable text embedding backends: OpenAI's API, or a local CPU-only hashed n-gram vectorizer
+"""
+
+import re
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+import openai
+
+class Embedder:
+    """Turns texts into float32 vectors of a fixed dimension
+
+    `name` identifies the vector space: it keys the embedding cache and vector
+    ids, so vectors from different embedders are never mixed. Remote embedders
+    go through the pipeline's token packing and rate-limit scheduler.
+    """
+
+    name = ""
+    dimension = 0
+    remote = False
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+class OpenAIEmbedder(Embedder):
+    remote = True
+
+    def __init__(self, model: str = "text-embedding-ada-002", dimension: int = 1536):
+        self.name = model
+        self.dimension = dimension
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        response = openai.embeddings.create(input=texts, model=self.name)
+        return np.array([item.embedding for item in response.data], dtype=np.float32)
+
+WORD = re.compile(r'\w+')
+
+def _hashed_features(text: str, dimension: int):
+    """(columns, signed weights) for word unigrams, word bigrams and character trigrams"""
+    words = WORD.findall(text.lower())
+    features = list(words)
+    features += [f"{a} {b}" for a, b in zip(words, words[1:])]
+    for word in words:
+        padded = f"<{word}>"
+        features += [f"#{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+
+    hashes = np.fromiter((zlib.crc32(feature.encode('utf-8')) for feature in features), dtype=np.int64,
+                         count=len(features))
+    columns = hashes % dimension
+    # An independent hash bit picks the sign, so collisions cancel out on average
+    signs = np.where((hashes // dimension) & 1, 1.0, -1.0)
+    return columns, signs
+
+def _hash_embed_batch(args) -> np.ndarray:
+    texts, dimension = args
+    matrix = np.zeros((len(texts), dimension), dtype=np.float32)
+    for row, text in enumerate(texts):
+        columns, signs = _hashed_features(text, dimension)
+        if len(columns):
+            matrix[row] = np.bincount(columns, weights=signs, minlength=dimension)
+
+    # Sublinear term frequency, then unit length for cosine similarity
+    matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+class HashingEmbedder(Embedder):
+    """Local, deterministic bag of hashed word and character n-grams
+
+    No model download and no network. Large inputs are split into batches
+    across `processes` CPU cores.
+    """
+
+    def __init__(self, dimension: int = 1024, batch_size: int = 2000, processes: Optional[int] = None):
+        self.name = f"hashing-ngram-v1-{dimension}"
+        self.dimension = dimension
+        self.batch_size = batch_size
+        self.processes = processes
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        batches = [(texts[i:i + self.batch_size], self.dimension) for i in range(0, len(texts), self.batch_size)]
+        if not batches:
+            return np.empty((0, self.dimension), dtype=np.float32)
+        if len(batches) == 1 or self.processes == 1:
+            return np.vstack([_hash_embed_batch(batch) for batch in batches])
+        with ProcessPoolExecutor(max_workers=self.processes) as executor:
+            return np.vstack(list(executor.map(_hash_embed_batch, batches)))
+
+def get_embedder(backend: str = "openai", **options) -> Embedder:
+    """Embedder for a config value: "openai" or "local" """
+    if backend == "openai":
+        return OpenAIEmbedder(**options)
+    if backend == "local":
+        return HashingEmbedder(**options)
+    raise ValueError(f"Unknown embedding backend: {backend}")
@@ -0,0 +1,243 @@
+"""
+HTTP Response Cache
+Content-addressed on-disk cache for GET/HEAD responses, shared by the scraper and the Streamlit app
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, Optional
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+# Headers that describe the wire format, not the (already decoded) body we store
+HOP_HEADERS = {'content-encoding', 'transfer-encoding', 'content-length', 'connection', 'keep-alive'}
+
+def parse_cache_control(value: Optional[str]) -> Dict[str, Optional[str]]:
+    """'max-age=60, no-cache' -> {'max-age': '60', 'no-cache': None}"""
+    directives = {}
+    for part in (value or '').split(','):
+        name, _, arg = part.strip().partition('=')
+        if name:
+            directives[name.lower()] = arg.strip('"') or None
+    return directives
+
+class HttpCache:
+    """On-disk response cache with TTL, Cache-Control support and size-based LRU eviction
+
+    Bodies live under `cache_dir/objects/` named by their SHA-256, so identical
+    pages fetched from different URLs are stored once. A SQLite index maps
+    (method, url) to status, headers, body hash and expiry, and is safe to
+    share between threads and processes.
+    """
+
+    def __init__(self, cache_dir: str = ".http_cache", default_ttl: float = 3600,
+                 max_bytes: int = 256 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.join(cache_dir, 'objects'), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(cache_dir, 'index.sqlite'), timeout=30, check_same_thread=False)
+        with self._lock, self.db:
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    method TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    final_url TEXT,
+                    status INTEGER NOT NULL,
+                    headers TEXT NOT NULL,
+                    body_hash TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    stored_at REAL NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (method, url)
+                )
+            ''')
+            self.db.execute('CREATE INDEX IF NOT EXISTS idx_last_access ON responses (last_access)')
+
+    def request(self, method: str, url: str, send: Callable[..., requests.Response],
+                before_send: Optional[Callable[[str], None]] = None, **kwargs) -> requests.Response:
+        """Serve `url` from cache if fresh, otherwise call send(url, **kwargs) and cache the result
+
+        Stale entries with an ETag/Last-Modified are revalidated with a
+        conditional request. `before_send` runs only when the network is
+        actually used (e.g. a rate limiter).
+        """
+        method = method.upper()
+        entry = self._lookup(method, url)
+
+        if entry and entry['expires_at'] > time.time():
+            body = self._read_body(entry['body_hash'])
+            if body is not None:
+                self._touch(method, url)
+                return self._build_response(entry, body)
+
+        headers = dict(kwargs.pop('headers', None) or {})
+        revalidating = False
+        if entry and not any(h.lower().startswith('if-') for h in headers):
+            cached_headers = json.loads(entry['headers'])
+            if cached_headers.get('ETag'):
+                headers['If-None-Match'] = cached_headers['ETag']
+                revalidating = True
+            if cached_headers.get('Last-Modified'):
+                headers['If-Modified-Since'] = cached_headers['Last-Modified']
+                revalidating = True
+
+        if before_send:
+            before_send(url)
+        response = send(url, headers=headers, **kwargs)
+
+        if response.status_code == 304 and entry:
+            if not revalidating:
+                # The caller's own conditional headers got the 304; it still confirms the cached copy
+                # unless the server names a different ETag, and the caller gets the 304 it asked for
+                etag = response.headers.get('ETag')
+                if not etag or etag == json.loads(entry['headers']).get('ETag'):
+                    self._refresh(method, url, response)
+                return response
+            body = self._read_body(entry['body_hash'])
+            if body is not None:
+                self._refresh(method, url, response)
+                return self._build_response(self._lookup(method, url), body)
+
+        self.store(method, url, response)
+        return response
+
+    def get(self, url: str, send: Callable[..., requests.Response] = requests.get, **kwargs) -> requests.Response:
+        return self.request('GET', url, send, **kwargs)
+
+    def head(self, url: str, send: Callable[..., requests.Response] = requests.head, **kwargs) -> requests.Response:
+        return self.request('HEAD', url, send, **kwargs)
+
+    def ttl_for(self, response: requests.Response) -> Optional[float]:
+        """Seconds the response stays fresh; None if it must not be stored"""
+        directives = parse_cache_control(response.headers.get('Cache-Control'))
+        if 'no-store' in directives:
+            return None
+        if 'no-cache' in directives:
+            return 0.0  # Keep it for revalidation, but never serve it unchecked
+        if directives.get('max-age') is not None:
+            try:
+                return max(0.0, float(directives['max-age']))
+            except ValueError:
+                return 0.0
+        if response.headers.get('Expires'):
+            try:
+                return max(0.0, parsedate_to_datetime(response.headers['Expires']).timestamp() - time.time())
+            except (TypeError, ValueError):
+                return 0.0
+        return self.default_ttl
+
+    def store(self, method: str, url: str, response: requests.Response):
+        """Cache a 200 response unless Cache-Control forbids it"""
+        if response.status_code != 200:
+            return
+        ttl = self.ttl_for(response)
+        if ttl is None:
+            return
+
+        body = response.content if method.upper() != 'HEAD' else b''
+        body_hash = hashlib.sha256(body).hexdigest()
+        path = self._body_path(body_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+
+        headers = {k: v for k, v in response.headers.items() if k.lower() not in HOP_HEADERS}
+        now = time.time()
+        with self._lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (method.upper(), url, response.url or url, response.status_code, json.dumps(headers),
+                 body_hash, len(body), now, now + ttl, now)
+            )
+        self._evict()
+
+    def clear(self):
+        with self._lock, self.db:
+            hashes = [row[0] for row in self.db.execute('SELECT DISTINCT body_hash FROM responses')]
+            self.db.execute('DELETE FROM responses')
+        for body_hash in hashes:
+            self._remove_body(body_hash)
+
+    def _evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes"""
+        with self._lock, self.db:
+            total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            if total <= self.max_bytes:
+                return
+
+            orphaned = []
+            for method, url, body_hash, size in self.db.execute(
+                    'SELECT method, url, body_hash, size FROM responses ORDER BY last_access').fetchall():
+                if total <= self.max_bytes:
+                    break
+                self.db.execute('DELETE FROM responses WHERE method = ? AND url = ?', (method, url))
+                total -= size
+                # Content-addressed: only delete the body once nothing points at it
+                if not self.db.execute('SELECT 1 FROM responses WHERE body_hash = ? LIMIT 1', (body_hash,)).fetchone():
+                    orphaned.append(body_hash)
+
+        for body_hash in orphaned:
+            self._remove_body(body_hash)
+
+    def _lookup(self, method: str, url: str) -> Optional[Dict]:
+        with self._lock:
+            cursor = self.db.execute('SELECT * FROM responses WHERE method = ? AND url = ?', (method, url))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([column[0] for column in cursor.description], row))
+
+    def _touch(self, method: str, url: str):
+        with self._lock, self.db:
+            self.db.execute('UPDATE responses SET last_access = ? WHERE method = ? AND url = ?',
+                            (time.time(), method, url))
+
+    def _refresh(self, method: str, url: str, not_modified: requests.Response):
+        """A 304 extends freshness using the new response's caching headers"""
+        ttl = self.ttl_for(not_modified)
+        now = time.time()
+        with self._lock, self.db:
+            self.db.execute('UPDATE responses SET expires_at = ?, last_access = ? WHERE method = ? AND url = ?',
+                            (now + (ttl or 0.0), now, method, url))
+
+    def _body_path(self, body_hash: str) -> str:
+        return os.path.join(self.cache_dir, 'objects', body_hash[:2], body_hash)
+
+    def _read_body(self, body_hash: str) -> Optional[bytes]:
+        try:
+            with open(self._body_path(body_hash), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _remove_body(self, body_hash: str):
+        try:
+            os.remove(self._body_path(body_hash))
+        except OSError:
+            pass
+
+    def _build_response(self, entry: Dict, body: bytes) -> requests.Response:
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.reason = 'OK'
+        response.headers = CaseInsensitiveDict(json.loads(entry['headers']))
+        response.url = entry['final_url'] or entry['url']
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = body
+        response.from_cache = True
+        return response
@@ -0,0 +1,215 @@
+"""
+Keyword Index
+SQLite inverted index with BM25 scoring over email subjects and bodies, with metadata prefilters
+"""
+
+import json
+import math
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+WORD = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+STOPWORDS = frozenset("""
+    a an and are as at be by for from has have in is it its of on or our that the this to was we were will with
+    you your
+""".split())
+
+# Metadata fields stored as columns, so filters on them run before any scoring
+FILTER_FIELDS = ('category', 'brand', 'source', 'has_emoji', 'has_urgency', 'has_discount', 'has_cta')
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in WORD.findall(text.lower()) if token not in STOPWORDS]
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> Dict[str, float]:
+    """Fuse ranked id lists: each id scores sum(1 / (k + rank)) over the lists it appears in
+
+    Only ranks are used, so BM25 and cosine scores never need to share a scale.
+    """
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            fused[item_id] = fused.get(item_id, 0.0) + 1.0 / (k + rank)
+    return fused
+
+class KeywordIndex:
+    """BM25 over subject + body, keyed by vector id
+
+    Postings and document frequencies live in SQLite and are updated
+    incrementally on add/remove. Filters (a Pinecone-style subset: equality,
+    $eq, $ne, $in, $nin on FILTER_FIELDS) restrict the joined documents in
+    SQL, so a filtered query only reads postings of documents that pass.
+    """
+
+    def __init__(self, filename: str = "keyword_index.sqlite", k1: float = 1.2, b: float = 0.75):
+        self.filename = filename
+        self.k1 = k1
+        self.b = b
+        self._stats: Optional[Tuple[int, float]] = None  # (documents, average length)
+        self._lock = threading.RLock()
+
+        # Shared across the app's script threads; every access holds the lock
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        columns = ', '.join(f'{field} {"INTEGER" if field.startswith("has_") else "TEXT"}' for field in FILTER_FIELDS)
+        with self.db:
+            self.db.execute(f'''
+                CREATE TABLE IF NOT EXISTS docs (
+                    doc INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, length INTEGER NOT NULL,
+                    metadata TEXT NOT NULL, {columns}
+                )
+            ''')
+            self.db.execute('''
+                CREATE TABLE IF NOT EXISTS postings (
+                    term TEXT NOT NULL, doc INTEGER NOT NULL, tf INTEGER NOT NULL, PRIMARY KEY (term, doc)
+                ) WITHOUT ROWID
+            ''')
+            self.db.execute('CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings (doc)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID')
+            for field in ('category', 'has_discount', 'has_urgency', 'has_cta'):
+                self.db.execute(f'CREATE INDEX IF NOT EXISTS idx_docs_{field} ON docs ({field})')
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.db.execute('SELECT COUNT(*) FROM docs').fetchone()[0]
+
+    def known(self, ids: List[str]) -> List[str]:
+        """Which of `ids` are already indexed"""
+        with self._lock:
+            found = []
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                found.extend(row[0] for row in self.db.execute(f'SELECT id FROM docs WHERE id IN ({placeholders})', chunk))
+            return found
+
+    def add(self, ids: List[str], metadata: List[Dict], texts: Optional[List[str]] = None):
+        """Index documents by `texts` (default: subject + body of each metadata dict); existing ids are replaced"""
+        if texts is None:
+            texts = [f"{fields.get('subject', '')} {fields.get('body', '')}" for fields in metadata]
+        with self._lock:
+            self.remove(ids)
+            df_updates = Counter()
+            with self.db:
+                for vector_id, fields, text in zip(ids, metadata, texts):
+                    counts = Counter(tokenize(text))
+                    filter_values = [fields.get(field) for field in FILTER_FIELDS]
+                    cursor = self.db.execute(
+                        f'INSERT INTO docs (id, length, metadata, {", ".join(FILTER_FIELDS)}) '
+                        f'VALUES (?, ?, ?, {", ".join("?" * len(FILTER_FIELDS))})',
+                        [vector_id, sum(counts.values()), json.dumps(fields, ensure_ascii=False)] + filter_values
+                    )
+                    self.db.executemany('INSERT INTO postings VALUES (?, ?, ?)',
+                                        [(term, cursor.lastrowid, tf) for term, tf in counts.items()])
+                    df_updates.update(counts.keys())
+                self.db.executemany('INSERT INTO terms VALUES (?, ?) ON CONFLICT (term) DO UPDATE SET df = df + excluded.df',
+                                    list(df_updates.items()))
+            self._stats = None
+
+    def remove(self, ids: List[str]):
+        with self._lock, self.db:
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                docs = [row[0] for row in self.db.execute(f'SELECT doc FROM docs WHERE id IN ({placeholders})', chunk)]
+                if not docs:
+                    continue
+                doc_placeholders = ','.join('?' * len(docs))
+                removed = self.db.execute(f'SELECT term, COUNT(*) FROM postings WHERE doc IN ({doc_placeholders}) '
+                                          'GROUP BY term', docs).fetchall()
+                self.db.executemany('UPDATE terms SET df = df - ? WHERE term = ?', [(n, term) for term, n in removed])
+                self.db.execute(f'DELETE FROM postings WHERE doc IN ({doc_placeholders})', docs)
+                self.db.execute(f'DELETE FROM docs WHERE doc IN ({doc_placeholders})', docs)
+            self.db.execute('DELETE FROM terms WHERE df <= 0')
+        self._stats = None
+
+    def clear(self):
+        with self._lock, self.db:
+            for table in ('docs', 'postings', 'terms'):
+                self.db.execute(f'DELETE FROM {table}')
+        self._stats = None
+
+    def get(self, ids: List[str]) -> Dict[str, Dict]:
+        """Stored metadata for whichever ids are indexed"""
+        with self._lock:
+            found = {}
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                for vector_id, metadata in self.db.execute(
+                        f'SELECT id, metadata FROM docs WHERE id IN ({placeholders})', chunk):
+                    found[vector_id] = json.loads(metadata)
+            return found
+
+    def values(self, field: str) -> List[str]:
+        """Distinct values of a filter field, e.g. the categories to offer as filters"""
+        with self._lock:
+            if field not in FILTER_FIELDS:
+                raise ValueError(f"Unknown filter field: {field}")
+            return [row[0] for row in self.db.execute(
+                f'SELECT DISTINCT {field} FROM docs WHERE {field} IS NOT NULL ORDER BY {field}')]
+
+    def search(self, query: str, top_k: int = 10, filter: Optional[Dict] = None) -> List[Tuple[str, float]]:
+        """Best (id, BM25 score) pairs for the query's terms among documents passing `filter`"""
+        with self._lock:
+            terms = list(dict.fromkeys(tokenize(query)))
+            if not terms or top_k <= 0:
+                return []
+            documents, average_length = self._corpus_stats()
+            if not documents:
+                return []
+
+            placeholders = ','.join('?' * len(terms))
+            idf = {
+                term: math.log(1 + (documents - df + 0.5) / (df + 0.5))
+                for term, df in self.db.execute(f'SELECT term, df FROM terms WHERE term IN ({placeholders})', terms)
+            }
+            if not idf:
+                return []
+
+            where, params = self._filter_sql(filter)
+            rows = self.db.execute(
+                f'SELECT p.doc, p.term, p.tf, d.length FROM postings p JOIN docs d ON d.doc = p.doc '
+                f'WHERE p.term IN ({",".join("?" * len(idf))}){where}',
+                list(idf) + params
+            )
+            scores: Dict[int, float] = {}
+            k1, b = self.k1, self.b
+            for doc, term, tf, length in rows:
+                norm = k1 * (1 - b + b * length / average_length)
+                scores[doc] = scores.get(doc, 0.0) + idf[term] * tf * (k1 + 1) / (tf + norm)
+
+            best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+            if not best:
+                return []
+            ids = dict(self.db.execute(f'SELECT doc, id FROM docs WHERE doc IN ({",".join("?" * len(best))})',
+                                       [doc for doc, _ in best]).fetchall())
+            return [(ids[doc], score) for doc, score in best]
+
+    def _corpus_stats(self) -> Tuple[int, float]:
+        if self._stats is None:
+            documents, total_length = self.db.execute('SELECT COUNT(*), SUM(length) FROM docs').fetchone()
+            self._stats = (documents, (total_length or 0) / documents if documents else 0.0)
+        return self._stats
+
+    @staticmethod
+    def _filter_sql(filter: Optional[Dict]) -> Tuple[str, List]:
+        """' AND ...' clause and parameters for a filter on FILTER_FIELDS"""
+        clauses, params = [], []
+        for field, condition in (filter or {}).items():
+            if field not in FILTER_FIELDS:
+                raise ValueError(f"Unsupported filter field: {field}")
+            if not isinstance(condition, dict):
+                condition = {'$eq': condition}
+            for op, expected in condition.items():
+                if op in ('$eq', '$ne'):
+                    clauses.append(f'd.{field} {"=" if op == "$eq" else "IS NOT"} ?')
+                    params.append(expected)
+                elif op in ('$in', '$nin'):
+                    expected = list(expected)
+                    clauses.append(f'd.{field} {"IN" if op == "$in" else "NOT IN"} ({",".join("?" * len(expected))})')
+                    params.extend(expected)
+                else:
+                    raise ValueError(f"Unsupported filter operator: {op}")
+        return ''.join(f' AND {clause}' for clause in clauses), params
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Scraper Benchmarks
+Measures scraper throughput offline: HTML extraction on saved pages, and
+end-to-end crawls against a local replay server standing in for the live site
+
+Usage:
+    python scraper_benchmark.py parse [templates/] --repeat 20
+    python scraper_benchmark.py record https://reallygoodemails.com/emails/announcement --out recorded_pages
+    python scraper_benchmark.py crawl --pages 200 --latency-ms 80 --error-rate 0.02 --workers 8
+    python scraper_benchmark.py crawl --recording recorded_pages
+"""
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin, urlparse
+
+import requests
+from bs4 import BeautifulSoup
+
+from email_template_scraper import FAST_PARSER, RGE_SELECTORS, EmailTemplateScraper, HtmlExtractor
+
+CATEGORY_PATH = "/emails/announcement"
+
+# =============================================================================
+# PARSE BENCHMARK
+# =============================================================================
+
+def load_saved_pages(pages_dir: str) -> List[bytes]:
+    """Read every saved .html page in a directory as raw bytes"""
+    pages = []
+    for path in sorted(glob.glob(os.path.join(pages_dir, '*.html'))):
+        with open(path, 'rb') as f:
+            pages.append(f.read())
+    return pages
+
+def legacy_extract(content: bytes) -> Dict[str, str]:
+    """The original path: full html.parser tree, select_one + double get_text per hit"""
+    soup = BeautifulSoup(content, 'html.parser')
+    result = {}
+    for name, selectors in RGE_SELECTORS.items():
+        result[name] = ""
+        for selector in selectors:
+            element = soup.select_one(selector)
+            if element and element.get_text().strip():
+                result[name] = element.get_text().strip()
+                break
+    return result
+
+def time_extractor(extract_fn, pages: List[bytes], repeat: int) -> float:
+    """Return pages/sec for extract_fn over all pages, `repeat` times"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for page in pages:
+            extract_fn(page)
+    elapsed = time.perf_counter() - start
+    return (len(pages) * repeat) / elapsed if elapsed else float('inf')
+
+def run_parse_benchmark(pages_dir: str = "templates", repeat: int = 10) -> Dict[str, float]:
+    """Compare pages/sec of the legacy and fast extraction paths"""
+    pages = load_saved_pages(pages_dir)
+    if not pages:
+        print(f"❌ No .html pages found in {pages_dir}")
+        return {}
+
+    total_kb = sum(len(page) for page in pages) / 1024
+    print(f"📂 {len(pages)} saved pages ({total_kb:.0f} KB) from {pages_dir}, {repeat} passes")
+
+    extractor = HtmlExtractor(RGE_SELECTORS)
+    strainer_state = "on" if extractor.strainer else "off"
+
+    # Both paths must agree before their speed means anything
+    mismatches = sum(1 for page in pages if legacy_extract(page) != extractor.extract(page))
+
+    legacy_rate = time_extractor(legacy_extract, pages, repeat)
+    fast_rate = time_extractor(extractor.extract, pages, repeat)
+
+    print("\n⏱️  PARSE BENCHMARK:")
+    print(f"  • legacy (html.parser, full tree): {legacy_rate:,.1f} pages/sec")
+    print(f"  • fast ({FAST_PARSER}, strainer {strainer_state}): {fast_rate:,.1f} pages/sec")
+    print(f"  • speedup: {fast_rate / legacy_rate:.1f}x")
+    if mismatches:
+        print(f"  ⚠️  {mismatches}/{len(pages)} pages extracted differently between paths")
+    else:
+        print(f"  ✅ Extracted fields identical on all {len(pages)} pages")
+
+    return {'legacy_pages_per_sec': legacy_rate, 'fast_pages_per_sec': fast_rate, 'mismatches': mismatches}
+
+# =============================================================================
+# RECORDING & REPLAY SERVER
+# =============================================================================
+
+def record_pages(category_url: str, out_dir: str = "recorded_pages", limit: int = 50) -> int:
+    """Fetch a category page and its email pages once and save them for replay"""
+    os.makedirs(out_dir, exist_ok=True)
+    session = requests.Session()
+    session.headers['User-Agent'] = EmailTemplateScraper().session.headers['User-Agent']
+
+    parsed = urlparse(category_url)
+    manifest = {'origin': f"{parsed.scheme}://{parsed.netloc}", 'entry': parsed.path or '/', 'pages': {}}
+
+    def save(url: str) -> Optional[requests.Response]:
+        response = session.get(url, timeout=15)
+        path = urlparse(url).path or '/'
+        filename = f"page_{len(manifest['pages']):05d}.html"
+        with open(os.path.join(out_dir, filename), 'wb') as f:
+            f.write(response.content)
+        manifest['pages'][path] = {
+            'file': filename,
+            'status': response.status_code,
+            'content_type': response.headers.get('Content-Type', 'text/html; charset=utf-8')
+        }
+        print(f"💾 {response.status_code} {url}")
+        time.sleep(1)  # Recording hits the real site - stay polite
+        return response
+
+    category = save(category_url)
+    soup = BeautifulSoup(category.content, FAST_PARSER)
+    links = [urljoin(category_url, a.get('href')) for a in soup.find_all('a', href=re.compile(r'/emails/'))]
+    for link in list(dict.fromkeys(links))[:limit]:
+        save(link)
+
+    with open(os.path.join(out_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+    print(f"✅ Recorded {len(manifest['pages'])} pages to {out_dir}")
+    return len(manifest['pages'])
+
+def build_synthetic_site(page_count: int, templates_dir: str = "templates") -> Dict[str, bytes]:
+    """RGE-shaped site built from the bundled template exports, for when nothing was recorded"""
+    bodies = load_saved_pages(templates_dir) or [b"<p>Placeholder email body</p>"]
+    pages = {}
+
+    links = ''.join(f'<a href="/emails/bench-{i}">Email {i}</a>' for i in range(page_count))
+    pages[CATEGORY_PATH] = f"<html><head><title>Announcement emails</title></head><body>{links}</body></html>".encode()
+
+    for i in range(page_count):
+        body = bodies[i % len(bodies)].decode('utf-8', errors='replace')
+        pages[f"/emails/bench-{i}"] = (
+            f'<html><body><h1>Benchmark email {i}</h1><span class="brand">Brand {i % 7}</span>'
+            f'<div class="email-body">{body}</div></body></html>'
+        ).encode('utf-8')
+
+    return pages
+
+def load_recording(recording_dir: str) -> Tuple[Dict[str, bytes], str]:
+    """Load a record_pages() directory as (pages, entry path); absolute links are made host-relative"""
+    with open(os.path.join(recording_dir, 'manifest.json'), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    origin = manifest['origin'].encode()
+    pages = {}
+    for path, entry in manifest['pages'].items():
+        with open(os.path.join(recording_dir, entry['file']), 'rb') as f:
+            pages[path] = f.read().replace(origin, b'')
+    return pages, manifest['entry']
+
+class ReplayServer:
+    """Local HTTP stand-in for a scraped site with configurable latency and error rate"""
+
+    def __init__(self, pages: Dict[str, bytes], latency_ms: float = 0.0, jitter_ms: float = 0.0,
+                 error_rate: float = 0.0, seed: int = 42, entry_path: str = CATEGORY_PATH):
+        self.pages = pages
+        self.entry_path = entry_path
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def _handler_class(self):
+        server = self
+
+        class ReplayHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = urlparse(self.path).path
+                with server._lock:
+                    server.request_count += 1
+                    delay = server.latency_ms + server.random.uniform(0, server.jitter_ms)
+                    # The entry page never fails, otherwise one unlucky draw aborts the whole run
+                    fail = path != server.entry_path and server.random.random() < server.error_rate
+                time.sleep(delay / 1000)
+
+                body = server.pages.get(path)
+                if fail:
+                    self._send(503, b"Service Unavailable")
+                elif body is None:
+                    self._send(404, b"Not Found")
+                else:
+                    self._send(200, body)
+
+            def _send(self, status: int, body: bytes):
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Keep benchmark output readable
+
+        return ReplayHandler
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+# =============================================================================
+# END-TO-END CRAWL BENCHMARK
+# =============================================================================
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def crawl_replay(pages: Dict[str, bytes], entry_path: str, workers: int, requests_per_second: float, burst: int,
+                 latency_ms: float, jitter_ms: float, error_rate: float,
+                 instrument=None) -> EmailTemplateScraper:
+    """One frontier crawl (crawl_really_good_emails, as main() runs it) of a fresh replay server"""
+    scraper = EmailTemplateScraper(max_workers=workers, requests_per_second=requests_per_second, burst=burst)
+    if instrument:
+        instrument(scraper)
+
+    with ReplayServer(pages, latency_ms, jitter_ms, error_rate, entry_path=entry_path) as server, \
+            tempfile.TemporaryDirectory() as frontier_dir:
+        with contextlib.redirect_stdout(io.StringIO()):
+            scraper.crawl_really_good_emails(max_pages=len(pages), category_urls=[server.base_url + entry_path],
+                                             sitemap_url=None,
+                                             frontier_file=os.path.join(frontier_dir, 'frontier.sqlite'))
+    return scraper
+
+def run_crawl_benchmark(pages: Dict[str, bytes], entry_path: str = CATEGORY_PATH, workers: int = 4,
+                        requests_per_second: float = 1000.0, burst: int = 10, latency_ms: float = 50.0,
+                        jitter_ms: float = 0.0, error_rate: float = 0.0, measure_memory: bool = True) -> Dict[str, float]:
+    """Drive EmailTemplateScraper.crawl_really_good_emails against a replay server
+
+    Timings come from an untraced crawl; peak memory from a second crawl
+    under tracemalloc, whose per-allocation overhead would skew the timings.
+    """
+    page_count = len(pages) - 1
+    print(f"🌐 Replaying {page_count} email pages: {latency_ms:.0f}ms latency (+{jitter_ms:.0f}ms jitter), "
+          f"{error_rate:.0%} errors, {workers} workers, {requests_per_second:g} req/s per host")
+    crawl_args = (pages, entry_path, workers, requests_per_second, burst, latency_ms, jitter_ms, error_rate)
+
+    fetch_times, parse_times = [], []
+    times_lock = threading.Lock()
+
+    def instrument(scraper: EmailTemplateScraper):
+        """Time the two stages we care about without changing scraper behaviour"""
+        fetch, extract = scraper.fetch, scraper.rge_extractor.extract
+
+        def timed_fetch(url, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fetch(url, **kwargs)
+            finally:
+                with times_lock:
+                    fetch_times.append(time.perf_counter() - start)
+
+        def timed_extract(content):
+            start = time.perf_counter()
+            try:
+                return extract(content)
+            finally:
+                with times_lock:
+                    parse_times.append(time.perf_counter() - start)
+
+        scraper.fetch = timed_fetch
+        scraper.rge_extractor.extract = timed_extract
+
+    start = time.perf_counter()
+    scraper = crawl_replay(*crawl_args, instrument=instrument)
+    elapsed = time.perf_counter() - start
+
+    peak_bytes = None
+    if measure_memory:
+        tracemalloc.start()
+        crawl_replay(*crawl_args)
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    results = {
+        'pages': len(fetch_times),
+        'records': scraper.email_count,
+        'elapsed_sec': elapsed,
+        'pages_per_sec': len(fetch_times) / elapsed if elapsed else 0.0,
+        'fetch_p50_ms': percentile(fetch_times, 50) * 1000,
+        'fetch_p99_ms': percentile(fetch_times, 99) * 1000,
+        'parse_ms_per_page': (sum(parse_times) / len(parse_times) * 1000) if parse_times else 0.0,
+        'peak_memory_mb': peak_bytes / 1024 / 1024 if peak_bytes is not None else None,
+    }
+
+    print("\n⏱️  CRAWL BENCHMARK:")
+    print(f"  • {results['pages']} requests, {results['records']} records in {elapsed:.2f}s")
+    print(f"  • throughput: {results['pages_per_sec']:,.1f} pages/sec")
+    print(f"  • fetch latency: p50 {results['fetch_p50_ms']:.1f}ms, p99 {results['fetch_p99_ms']:.1f}ms")
+    print(f"  • parse time: {results['parse_ms_per_page']:.2f}ms/page")
+    if peak_bytes is not None:
+        print(f"  • peak Python memory: {results['peak_memory_mb']:.1f} MB (separate traced crawl)")
+
+    return results
+
+# =============================================================================
+# MAIN FUNCTION
+# =============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark email template scraping offline")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parse_cmd = subparsers.add_parser('parse', help="Extraction throughput on saved pages")
+    parse_cmd.add_argument('pages_dir', nargs='?', default='templates', help="Directory of saved .html pages")
+    parse_cmd.add_argument('--repeat', type=int, default=10, help="Passes over the saved pages")
+
+    record_cmd = subparsers.add_parser('record', help="Save a category page and its emails for replay")
+    record_cmd.add_argument('url', help="Category page to record")
+    record_cmd.add_argument('--out', default='recorded_pages', help="Output directory")
+    record_cmd.add_argument('--limit', type=int, default=50, help="Email pages to record")
+
+    crawl_cmd = subparsers.add_parser('crawl', help="End-to-end crawl against a local replay server")
+    crawl_cmd.add_argument('--recording', help="Directory written by `record` (default: synthetic site)")
+    crawl_cmd.add_argument('--pages', type=int, default=100, help="Synthetic email pages")
+    crawl_cmd.add_argument('--workers', type=int, default=4)
+    crawl_cmd.add_argument('--rps', type=float, default=1000.0, help="Per-host rate limit")
+    crawl_cmd.add_argument('--burst', type=int, default=10)
+    crawl_cmd.add_argument('--latency-ms', type=float, default=50.0)
+    crawl_cmd.add_argument('--jitter-ms', type=float, default=0.0)
+    crawl_cmd.add_argument('--error-rate', type=float, default=0.0)
+    crawl_cmd.add_argument('--skip-memory', action='store_true', help="Skip the traced crawl for peak memory")
+
+    args = parser.parse_args()
+
+    print("🚀 SCRAPER BENCHMARK")
+    print("=" * 50)
+
+    if args.command == 'parse':
+        return run_parse_benchmark(args.pages_dir, args.repeat)
+    if args.command == 'record':
+        return record_pages(args.url, args.out, args.limit)
+
+    if args.recording:
+        pages, entry_path = load_recording(args.recording)
+    else:
+        pages, entry_path = build_synthetic_site(args.pages), CATEGORY_PATH
+    return run_crawl_benchmark(pages, entry_path, args.workers, args.rps, args.burst,
+                               args.latency_ms, args.jitter_ms, args.error_rate, not args.skip_memory)
+
+if __name__ == "__main__":
+    main()
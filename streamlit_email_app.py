@@ -9,18 +9,38 @@ from datetime import datetime
 import time
 from typing import List, Dict, Optional
 import base64
+import os
 from io import BytesIO
 from PIL import Image
 
+from http_cache import HttpCache
+from vector_store import LocalVectorStore, QueryMatch, aggregate_to_parents, backend_file
+from embedders import get_embedder
+from keyword_index import KeywordIndex, reciprocal_rank_fusion
+from document_store import DocumentStore
+from email_cleaning import SECTION_QUERY_FACTOR
+
 # =============================================================================
 # CONFIGURATION
 # =============================================================================
 
 # API Keys - IMPORTANT: Use Streamlit secrets in production
 OPENAI_API_KEY = st.secrets["openai"]["api_key"]
-PINECONE_API_KEY = st.secrets["pinecone"]["api_key"]
+PINECONE_API_KEY = st.secrets.get("pinecone", {}).get("api_key", "your_pinecone_key_here")
 openai.api_key = OPENAI_API_KEY
 
+# "pinecone", or "local" for the on-disk index built by vector_storage_pipeline.py
+VECTOR_BACKEND = st.secrets.get("vector_store", {}).get("backend", "pinecone")
+LOCAL_INDEX_DIR = "vector_indexes"
+LOCAL_INDEX_QUANTIZATION = st.secrets.get("vector_store", {}).get("quantization")
+# Must match the embedder the index was built with: "openai", or "local" for the CPU-only hashed n-gram embedder
+EMBEDDING_BACKEND = st.secrets.get("embeddings", {}).get("backend", "openai")
+# BM25 index written by vector_storage_pipeline.py (one per vector backend), fused with vector results
+KEYWORD_INDEX_FILE = backend_file("keyword_index.sqlite", VECTOR_BACKEND)
+# Full subjects and bodies, keyed by email vector id; the vector index only holds filterable fields
+DOCUMENT_STORE_FILE = backend_file("email_documents.sqlite", VECTOR_BACKEND)
+RRF_K = 60
+
 # Initialize OpenAI client
 if OPENAI_API_KEY != "your_openai_key_here":
     openai.api_key = OPENAI_API_KEY
@@ -29,11 +49,47 @@ if OPENAI_API_KEY != "your_openai_key_here":
 else:
     st.error("⚠️ OpenAI API key not configured. Please set OPENAI_API_KEY in Streamlit secrets.")
 
-# Initialize Pinecone
-if PINECONE_API_KEY != "your_pinecone_key_here":
+@st.cache_resource
+def load_local_index(directory: str, name: str, quantization: Optional[str] = None):
+    """Load the local vector index once per server process, not on every rerun"""
+    store = LocalVectorStore(directory, quantization=quantization)
+    return store.Index(name) if store.has_index(name) else None
+
+@st.cache_resource
+def load_embedder(backend: str):
+    """Query embedder for the configured backend, built once per server process"""
+    return get_embedder(backend)
+
+@st.cache_resource
+def load_keyword_index(filename: str):
+    """Open the keyword index once per server process, if the pipeline has built one"""
+    return KeywordIndex(filename) if os.path.exists(filename) else None
+
+@st.cache_resource
+def load_document_store(filename: str):
+    """Open the document store once per server process, if the pipeline has built one"""
+    return DocumentStore(filename) if os.path.exists(filename) else None
+
+@st.cache_resource
+def load_http_cache(cache_dir: str):
+    """Shared on-disk HTTP cache, opened once per server process - repeat lookups of a site are served locally"""
+    return HttpCache(cache_dir)
+
+@st.cache_resource
+def connect_pinecone(api_key: str, name: str):
+    """One Pinecone client and index handle (with its connection pool) per server process"""
+    pc = Pinecone(api_key=api_key)
+    return pc, pc.Index(name)
+
+# Initialize the vector index
+if VECTOR_BACKEND == "local":
+    pc = None
+    index = load_local_index(LOCAL_INDEX_DIR, "email-campaigns", LOCAL_INDEX_QUANTIZATION)
+    if index is None:
+        st.warning(f"Local vector index not found in {LOCAL_INDEX_DIR}/ - run vector_storage_pipeline.py first.")
+elif PINECONE_API_KEY != "your_pinecone_key_here":
     try:
-        pc = Pinecone(api_key=PINECONE_API_KEY)
-        index = pc.Index("email-campaigns")
+        pc, index = connect_pinecone(PINECONE_API_KEY, "email-campaigns")
     except Exception as e:
         st.warning(f"Pinecone initialization failed: {e}")
         pc = None
@@ -42,6 +98,8 @@ else:
     pc = None
     index = None
 
+http_cache = load_http_cache(".http_cache")
+
 # =============================================================================
 # CORE FUNCTIONALITY
 # =============================================================================
@@ -49,6 +107,9 @@ else:
 class EmailGenerator:
     def __init__(self):
         self.index = index
+        self.embedder = load_embedder(EMBEDDING_BACKEND)
+        self.keyword_index = load_keyword_index(KEYWORD_INDEX_FILE)
+        self.document_store = load_document_store(DOCUMENT_STORE_FILE)
         
     def extract_product_images(self, url: str) -> List[str]:
         """Extract product images from the website"""
@@ -60,7 +121,7 @@ class EmailGenerator:
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
             }
             
-            response = requests.get(url, headers=headers, timeout=15)
+            response = http_cache.get(url, headers=headers, timeout=15)
             response.raise_for_status()
             
             soup = BeautifulSoup(response.content, 'html.parser')
@@ -122,7 +183,7 @@ class EmailGenerator:
             valid_images = []
             for img_url in unique_images:
                 try:
-                    img_response = requests.head(img_url, timeout=5)
+                    img_response = http_cache.head(img_url, timeout=5)
                     if img_response.status_code == 200:
                         content_type = img_response.headers.get('content-type', '')
                         if 'image' in content_type:
@@ -988,7 +1049,7 @@ class EmailGenerator:
                 'Connection': 'keep-alive',
             }
             
-            response = requests.get(url, headers=headers, timeout=15, allow_redirects=True)
+            response = http_cache.get(url, headers=headers, timeout=15, allow_redirects=True)
             response.raise_for_status()
             
             soup = BeautifulSoup(response.content, 'html.parser')
@@ -1055,73 +1116,120 @@ class EmailGenerator:
             st.error(f"Error scraping website: {e}")
             return {'title': '', 'description': '', 'content': '', 'headings': [], 'url': url}
     
-    def find_similar_emails(self, query_text: str, top_k: int = 5) -> List[Dict]:
-        """Find similar emails from the vector database"""
-        if not self.index:
+    def find_similar_emails(self, query_text: str, top_k: int = 5, filters: Optional[Dict] = None) -> List[Dict]:
+        """Find similar emails: vector and BM25 keyword rankings fused, metadata filters applied before scoring"""
+        if not self.index and not self.keyword_index:
             # Return enhanced mock data if Pinecone not configured
-            return [
-                {
-                    'score': 0.89,
-                    'subject': '🚀 Exciting Product Launch: Revolutionary App Now Available!',
-                    'category': 'product_launch',
-                    'body': 'We are thrilled to announce the launch of our groundbreaking mobile app that will transform how you manage your daily tasks. With cutting-edge features and an intuitive interface, this app is designed to boost your productivity by 300%.',
-                    'brand': 'TechCorp',
-                    'has_discount': False,
-                    'has_urgency': True
-                },
-                {
-                    'score': 0.85,
-                    'subject': '✨ New Feature Alert: Enhanced User Experience',
-                    'category': 'feature_announcement', 
-                    'body': 'Get ready for an improved experience with our latest feature updates. We have listened to your feedback and implemented powerful new tools that will streamline your workflow.',
-                    'brand': 'ProductCo',
-                    'has_discount': True,
-                    'has_urgency': False
-                },
-                {
-                    'score': 0.82,
-                    'subject': '🎉 Special Launch Offer: 50% Off Premium Features',
-                    'category': 'special_offer',
-                    'body': 'To celebrate our new product launch, we are offering an exclusive 50% discount on all premium features. This limited-time offer expires in 48 hours.',
-                    'brand': 'StartupXYZ',
-                    'has_discount': True,
-                    'has_urgency': True
-                }
-            ]
+            return self.mock_similar_emails()
         
         try:
-            # Generate embedding for the query
-            response = openai.embeddings.create(
-                input=[query_text],
-                model="text-embedding-ada-002"
-            )
-            query_embedding = response.data[0].embedding
-            
-            # Search Pinecone
-            results = self.index.query(
-                vector=query_embedding,
-                top_k=top_k,
-                include_metadata=True
-            )
+            # Each side ranks a wider pool so fusion has overlap to work with
+            candidates = top_k * 4
+            section_candidates = candidates * SECTION_QUERY_FACTOR
+            rankings, found, vector_scores, keyword_scores = [], {}, {}, {}
+            
+            if self.index:
+                # Generate embedding for the query
+                query_embedding = self.embedder.embed([query_text])[0].tolist()
+                
+                # Search Pinecone, restricted to emails that pass the filters
+                results = self.index.query(
+                    vector=query_embedding,
+                    top_k=section_candidates,
+                    include_metadata=True,
+                    filter=filters or None
+                )
+                # Section hits collapse into their parent email, scored by its best section
+                matches = aggregate_to_parents(results.matches, candidates)
+                for match in matches:
+                    vector_scores[match.id] = float(match.score)
+                    found[match.id] = match.metadata
+                if matches:
+                    rankings.append([match.id for match in matches])
+            
+            if self.keyword_index:
+                # Exact terms the user typed, scored by BM25 over the same filtered subset
+                hits = self.keyword_index.search(query_text, section_candidates, filters)
+                hit_metadata = self.keyword_index.get([vector_id for vector_id, _ in hits])
+                matches = aggregate_to_parents(
+                    [QueryMatch(vector_id, score, hit_metadata.get(vector_id)) for vector_id, score in hits], candidates
+                )
+                for match in matches:
+                    keyword_scores[match.id] = match.score
+                    found.setdefault(match.id, match.metadata)
+                if matches:
+                    rankings.append([match.id for match in matches])
+            
+            fused = reciprocal_rank_fusion(rankings, RRF_K)
+            best = sorted(fused, key=fused.get, reverse=True)[:top_k]
+            # Full documents for the final top_k only, in one local lookup
+            documents = self.document_store.get(best) if self.document_store else {}
+            # 1.0 = ranked first by every retriever that found anything
+            best_possible = max(len(rankings), 1) / (RRF_K + 1)
             
             similar_emails = []
-            for match in results.matches:
+            for vector_id in best:
+                metadata = {**found.get(vector_id, {}), **documents.get(vector_id, {})}
                 similar_emails.append({
-                    'score': float(match.score),
-                    'subject': match.metadata.get('subject', ''),
-                    'body': match.metadata.get('body', ''),
-                    'category': match.metadata.get('category', ''),
-                    'brand': match.metadata.get('brand', ''),
-                    'has_discount': match.metadata.get('has_discount', False),
-                    'has_urgency': match.metadata.get('has_urgency', False)
+                    'score': fused[vector_id] / best_possible,
+                    'vector_score': vector_scores.get(vector_id),
+                    'keyword_score': keyword_scores.get(vector_id),
+                    'subject': metadata.get('subject', ''),
+                    'body': metadata.get('body', ''),
+                    'category': metadata.get('category', ''),
+                    'brand': metadata.get('brand', ''),
+                    'has_discount': metadata.get('has_discount', False),
+                    'has_urgency': metadata.get('has_urgency', False)
                 })
             
+            # Vector metadata only holds filter fields; without the document an example has no text to show
+            missing = sum(1 for email in similar_emails if not (email['subject'] or email['body']))
+            if missing:
+                st.warning(f"⚠️ {missing} matching emails have no stored text - {DOCUMENT_STORE_FILE} is missing or "
+                           f"out of date; re-run vector_storage_pipeline.py.")
+                similar_emails = [email for email in similar_emails if email['subject'] or email['body']]
+                if not similar_emails:
+                    st.info("Showing sample examples instead.")
+                    return self.mock_similar_emails()
+            
             return similar_emails
             
         except Exception as e:
             st.error(f"Error finding similar emails: {e}")
             # Return mock data as fallback
-            return self.find_similar_emails("", top_k)  # This will return mock data
+            return self.mock_similar_emails()
+    
+    def mock_similar_emails(self) -> List[Dict]:
+        """Sample examples used when no index is configured or search fails"""
+        return [
+            {
+                'score': 0.89,
+                'subject': '🚀 Exciting Product Launch: Revolutionary App Now Available!',
+                'category': 'product_launch',
+                'body': 'We are thrilled to announce the launch of our groundbreaking mobile app that will transform how you manage your daily tasks. With cutting-edge features and an intuitive interface, this app is designed to boost your productivity by 300%.',
+                'brand': 'TechCorp',
+                'has_discount': False,
+                'has_urgency': True
+            },
+            {
+                'score': 0.85,
+                'subject': '✨ New Feature Alert: Enhanced User Experience',
+                'category': 'feature_announcement', 
+                'body': 'Get ready for an improved experience with our latest feature updates. We have listened to your feedback and implemented powerful new tools that will streamline your workflow.',
+                'brand': 'ProductCo',
+                'has_discount': True,
+                'has_urgency': False
+            },
+            {
+                'score': 0.82,
+                'subject': '🎉 Special Launch Offer: 50% Off Premium Features',
+                'category': 'special_offer',
+                'body': 'To celebrate our new product launch, we are offering an exclusive 50% discount on all premium features. This limited-time offer expires in 48 hours.',
+                'brand': 'StartupXYZ',
+                'has_discount': True,
+                'has_urgency': True
+            }
+        ]
     
     def generate_email_content(self, user_input: Dict, similar_emails: List[Dict]) -> Dict[str, str]:
         """Generate new email content based on user input and similar examples"""
@@ -1346,6 +1454,12 @@ def main():
     with col2:
         if pc and index:
             st.success("✅ Pinecone Connected")
+        elif index:
+            # Long emails are indexed as several sections, so vectors outnumber emails
+            sections = index.describe_index_stats().total_vector_count
+            documents = load_document_store(DOCUMENT_STORE_FILE)
+            emails = f"{len(documents)} emails, " if documents is not None else ""
+            st.success(f"✅ Local Index ({emails}{sections} sections)")
         else:
             st.warning("⚠️ Using Mock Data")
     with col3:
@@ -1413,6 +1527,28 @@ def main():
                 ["Professional", "Friendly", "Exciting", "Urgent", "Casual", "Formal"]
             )
         
+        # Filters on the example emails, applied before any similarity scoring
+        with st.expander("🔎 Example Filters"):
+            categories = generator.keyword_index.values('category') if generator.keyword_index else []
+            example_categories = st.multiselect(
+                "Example Categories",
+                categories,
+                help="Only draw examples from these categories (all when empty)"
+            )
+            only_discount = st.checkbox("💰 Only examples with a discount")
+            only_urgency = st.checkbox("⚡ Only examples with urgency")
+            only_cta = st.checkbox("👆 Only examples with a call to action")
+            
+            example_filters = {}
+            if example_categories:
+                example_filters['category'] = {'$in': example_categories}
+            if only_discount:
+                example_filters['has_discount'] = True
+            if only_urgency:
+                example_filters['has_urgency'] = True
+            if only_cta:
+                example_filters['has_cta'] = True
+        
         # Website analysis
         with st.expander("🌐 Website Analysis"):
             website_url = st.text_input(
@@ -1754,7 +1890,7 @@ def main():
         # Step 1: Find similar emails
         status_text.text("🔍 Finding similar emails...")
         progress_bar.progress(20)
-        similar_emails = generator.find_similar_emails(search_query)
+        similar_emails = generator.find_similar_emails(search_query, filters=example_filters)
         
         # Step 2: Generate content
         status_text.text("✍️ Generating your email...")
@@ -0,0 +1,856 @@
+"""
+Vector Store
+Pluggable vector backends: Pinecone, or a local on-disk index with exact and HNSW search
+"""
+
+import heapq
+import json
+import math
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+
+# =============================================================================
+# RESULTS & FILTERS
+# =============================================================================
+
+class QueryMatch:
+    """One query hit, shaped like a Pinecone match"""
+
+    def __init__(self, id: str, score: float, metadata: Optional[Dict] = None, values: Optional[List[float]] = None):
+        self.id = id
+        self.score = score
+        self.metadata = metadata or {}
+        self.values = values or []
+
+class QueryResult:
+    def __init__(self, matches: List[QueryMatch]):
+        self.matches = matches
+
+class IndexStats:
+    def __init__(self, total_vector_count: int, dimension: int):
+        self.total_vector_count = total_vector_count
+        self.dimension = dimension
+
+RANGE_OPERATORS = {'$gt': np.greater, '$gte': np.greater_equal, '$lt': np.less, '$lte': np.less_equal}
+
+def filter_mask(column: Callable[[str], np.ndarray], filter: Dict, size: int) -> np.ndarray:
+    """Rows passing a Pinecone-style metadata filter ($eq, $ne, $in, $nin, $gt(e), $lt(e), $and, $or)
+
+    `column(field)` returns that field's values for all `size` rows as an
+    object array (None where missing), so each condition is one vectorized
+    comparison instead of a Python call per row.
+    """
+    mask = np.ones(size, dtype=bool)
+    for field, condition in filter.items():
+        if field == '$and':
+            for sub in condition:
+                mask &= filter_mask(column, sub, size)
+            continue
+        if field == '$or':
+            either = np.zeros(size, dtype=bool)
+            for sub in condition:
+                either |= filter_mask(column, sub, size)
+            mask &= either
+            continue
+
+        values = column(field)
+        if not isinstance(condition, dict):
+            condition = {'$eq': condition}
+        for op, expected in condition.items():
+            if op == '$eq':
+                mask &= values == expected
+            elif op == '$ne':
+                mask &= values != expected
+            elif op in ('$in', '$nin'):
+                found = np.zeros(size, dtype=bool)
+                for option in expected:
+                    found |= values == option
+                mask &= found if op == '$in' else ~found
+            elif op in RANGE_OPERATORS:
+                # Missing values never pass a range condition
+                present = np.not_equal(values, None)
+                passed = np.zeros(size, dtype=bool)
+                passed[present] = RANGE_OPERATORS[op](values[present], expected)
+                mask &= passed
+            else:
+                raise ValueError(f"Unsupported filter operator: {op}")
+    return mask
+
+def aggregate_to_parents(matches: List, top_k: Optional[int] = None) -> List[QueryMatch]:
+    """Collapse section matches into one match per parent email: its best section's score and metadata
+
+    Works on local and Pinecone matches alike; a match without a parent_id
+    is its own parent.
+    """
+    parents: Dict[str, QueryMatch] = {}
+    for match in matches:
+        metadata = match.metadata or {}
+        parent_id = metadata.get('parent_id') or match.id
+        best = parents.get(parent_id)
+        if best is None or match.score > best.score:
+            parents[parent_id] = QueryMatch(parent_id, match.score, metadata)
+    ranked = sorted(parents.values(), key=lambda parent: parent.score, reverse=True)
+    return ranked[:top_k] if top_k is not None else ranked
+
+# =============================================================================
+# HNSW GRAPH
+# =============================================================================
+
+class HnswGraph:
+    """Hierarchical navigable small-world graph over rows of a unit-normalized matrix
+
+    Nodes are row numbers; similarity is the dot product. Neighbor lists are
+    plain Python lists, distances are computed in NumPy one frontier at a time.
+    """
+
+    def __init__(self, M: int = 16, ef_construction: int = 100, seed: int = 42):
+        self.M = M
+        self.M0 = 2 * M  # Layer 0 keeps more links
+        self.ef_construction = ef_construction
+        self.level_mult = 1 / math.log(M)
+        self.layers: List[Dict[int, List[int]]] = []
+        self.entry = -1
+        self.rng = random.Random(seed)
+
+    def __len__(self) -> int:
+        return len(self.layers[0]) if self.layers else 0
+
+    def _search_layer(self, vectors: np.ndarray, query: np.ndarray, entries: List[int], ef: int, layer: int):
+        """Best-first search of one layer; returns [(similarity, node)] best first"""
+        links = self.layers[layer]
+        visited = set(entries)
+        sims = (vectors[entries] @ query).tolist()
+        candidates = [(-sim, node) for sim, node in zip(sims, entries)]
+        heapq.heapify(candidates)
+        results = [(sim, node) for sim, node in zip(sims, entries)]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            neg_sim, node = heapq.heappop(candidates)
+            if len(results) >= ef and -neg_sim < results[0][0]:
+                break
+            neighbors = [n for n in links.get(node, ()) if n not in visited]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+            for sim, neighbor in zip((vectors[neighbors] @ query).tolist(), neighbors):
+                if len(results) < ef or sim > results[0][0]:
+                    heapq.heappush(candidates, (-sim, neighbor))
+                    heapq.heappush(results, (sim, neighbor))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return sorted(results, reverse=True)
+
+    def add(self, vectors: np.ndarray, node: int):
+        level = int(-math.log(1.0 - self.rng.random()) * self.level_mult)
+        if self.entry == -1:
+            self.layers = [{node: []} for _ in range(level + 1)]
+            self.entry = node
+            return
+
+        query = vectors[node]
+        entries = [self.entry]
+        top = len(self.layers) - 1
+        for layer in range(top, level, -1):
+            entries = [self._search_layer(vectors, query, entries, 1, layer)[0][1]]
+
+        for layer in range(min(level, top), -1, -1):
+            found = self._search_layer(vectors, query, entries, self.ef_construction, layer)
+            max_links = self.M0 if layer == 0 else self.M
+            neighbors = [n for _, n in found[:max_links]]
+            self.layers[layer][node] = neighbors
+            for neighbor in neighbors:
+                links = self.layers[layer][neighbor]
+                links.append(node)
+                if len(links) > max_links:
+                    # Keep the neighbor's closest links
+                    sims = vectors[links] @ vectors[neighbor]
+                    self.layers[layer][neighbor] = [links[i] for i in np.argsort(-sims)[:max_links]]
+            entries = [n for _, n in found]
+
+        if level > top:
+            for _ in range(top + 1, level + 1):
+                self.layers.append({node: []})
+            self.entry = node
+
+    def search(self, vectors: np.ndarray, query: np.ndarray, ef: int) -> List[int]:
+        """Up to ef candidate nodes, best first"""
+        if self.entry == -1:
+            return []
+        entries = [self.entry]
+        for layer in range(len(self.layers) - 1, 0, -1):
+            entries = [self._search_layer(vectors, query, entries, 1, layer)[0][1]]
+        return [node for _, node in self._search_layer(vectors, query, entries, ef, 0)]
+
+    def save(self, f):
+        arrays = {'params': np.array([self.M, self.ef_construction, self.entry, len(self.layers)])}
+        for layer, links in enumerate(self.layers):
+            nodes = list(links)
+            arrays[f'nodes_{layer}'] = np.array(nodes, dtype=np.int64)
+            arrays[f'offsets_{layer}'] = np.cumsum([0] + [len(links[n]) for n in nodes]).astype(np.int64)
+            arrays[f'links_{layer}'] = np.array([m for n in nodes for m in links[n]], dtype=np.int64)
+        np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, filename: str) -> 'HnswGraph':
+        data = np.load(filename)
+        M, ef_construction, entry, layer_count = data['params'].tolist()
+        graph = cls(M, ef_construction)
+        graph.entry = entry
+        for layer in range(layer_count):
+            nodes, offsets = data[f'nodes_{layer}'].tolist(), data[f'offsets_{layer}'].tolist()
+            links = data[f'links_{layer}'].tolist()
+            graph.layers.append({node: links[offsets[i]:offsets[i + 1]] for i, node in enumerate(nodes)})
+        return graph
+
+# =============================================================================
+# QUANTIZATION
+# =============================================================================
+
+QUANTIZE_BLOCK_ROWS = 8192  # Rows encoded or scored per step, bounding the scratch memory
+INT8_SCAN_ROWS = 256  # Small enough that each decoded float32 block stays in cache
+
+class ScalarQuantizer:
+    """int8 codes: each dimension mapped linearly from its trained [min, max] onto 0..255
+
+    4x smaller than float32. A code row scores as q·min + (q*scale)·codes.
+    """
+
+    kind = "int8"
+
+    def __init__(self, low: Optional[np.ndarray] = None, scale: Optional[np.ndarray] = None):
+        self.low = low
+        self.scale = scale
+
+    def train(self, sample: np.ndarray):
+        self.low = sample.min(axis=0).astype(np.float32)
+        self.scale = np.maximum((sample.max(axis=0) - self.low) / 255, 1e-12).astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.rint((vectors - self.low) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        weights = query * self.scale
+        offset = float(query @ self.low)
+        scores = np.empty(len(codes), dtype=np.float32)
+        decoded = np.empty((INT8_SCAN_ROWS, codes.shape[1] if codes.ndim == 2 else 0), dtype=np.float32)
+        for start in range(0, len(codes), INT8_SCAN_ROWS):
+            block = decoded[:len(codes[start:start + INT8_SCAN_ROWS])]
+            np.copyto(block, codes[start:start + INT8_SCAN_ROWS])
+            scores[start:start + len(block)] = block @ weights
+        return scores + offset
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {'low': self.low, 'scale': self.scale}
+
+class ProductQuantizer:
+    """PQ codes: the vector split into `subspaces` slices, each replaced by the id of its nearest of 256 centroids
+
+    One byte per subspace (1536 dims / 96 subspaces = 96 bytes, 64x smaller
+    than float32). Queries score codes through a per-query lookup table.
+    """
+
+    kind = "pq"
+
+    def __init__(self, subspaces: int = 96, centroids: Optional[np.ndarray] = None, iterations: int = 12,
+                 seed: int = 42):
+        self.subspaces = subspaces
+        self.centroids = centroids  # (subspaces, clusters, dimension // subspaces)
+        self.iterations = iterations
+        self.seed = seed
+
+    def train(self, sample: np.ndarray):
+        dimension = sample.shape[1]
+        if dimension % self.subspaces:
+            raise ValueError(f"PQ subspaces ({self.subspaces}) must divide the dimension ({dimension})")
+        rng = np.random.default_rng(self.seed)
+        clusters = min(256, len(sample))
+        parts = np.split(sample, self.subspaces, axis=1)
+        self.centroids = np.stack([self._kmeans(part, clusters, rng) for part in parts])
+
+    def _kmeans(self, points: np.ndarray, clusters: int, rng) -> np.ndarray:
+        centroids = points[rng.choice(len(points), clusters, replace=False)].copy()
+        for _ in range(self.iterations):
+            assignment = self._nearest(points, centroids)
+            sums = np.stack([np.bincount(assignment, weights=points[:, d], minlength=clusters)
+                             for d in range(points.shape[1])], axis=1)
+            counts = np.bincount(assignment, minlength=clusters)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+            # Reseed empty clusters from random points
+            empty = np.flatnonzero(~filled)
+            if len(empty):
+                centroids[empty] = points[rng.choice(len(points), len(empty))]
+        return centroids
+
+    @staticmethod
+    def _nearest(points: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        # argmin ||p - c||² = argmin (||c||² - 2 p·c)
+        return np.argmin((centroids ** 2).sum(axis=1) - 2 * points @ centroids.T, axis=1)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.empty((len(vectors), self.subspaces), dtype=np.uint8)
+        for start in range(0, len(vectors), QUANTIZE_BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + QUANTIZE_BLOCK_ROWS], dtype=np.float32)
+            for j, part in enumerate(np.split(block, self.subspaces, axis=1)):
+                codes[start:start + len(block), j] = self._nearest(part, self.centroids[j])
+        return codes
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        clusters = self.centroids.shape[1]
+        # table[j, c] = query slice j · centroid c of subspace j, flattened for one gather per block
+        table = np.einsum('jcd,jd->jc', self.centroids, query.reshape(self.subspaces, -1)).ravel()
+        offsets = (np.arange(self.subspaces) * clusters).astype(np.int32)
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), QUANTIZE_BLOCK_ROWS):
+            block = codes[start:start + QUANTIZE_BLOCK_ROWS]
+            scores[start:start + len(block)] = table[block + offsets].sum(axis=1)
+        return scores
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {'centroids': self.centroids}
+
+def make_quantizer(kind: str, dimension: int, pq_subspaces: Optional[int] = None):
+    """Untrained quantizer for "int8" or "pq" (PQ defaults to 16 dimensions per subspace)"""
+    if kind == "int8":
+        return ScalarQuantizer()
+    if kind == "pq":
+        return ProductQuantizer(pq_subspaces or max(1, dimension // 16))
+    raise ValueError(f"Unsupported quantization: {kind}")
+
+def load_quantizer(filename: str):
+    data = np.load(filename)
+    kind = str(data['kind'])
+    if kind == "int8":
+        return ScalarQuantizer(data['low'], data['scale'])
+    return ProductQuantizer(data['centroids'].shape[0], data['centroids'])
+
+# =============================================================================
+# LOCAL INDEX
+# =============================================================================
+
+class LocalVectorIndex:
+    """In-process vector index with the Pinecone Index API (upsert/query/fetch/delete/describe_index_stats)
+
+    Vectors are unit-normalized float32 rows of one matrix, so cosine
+    similarity is a single matrix-vector product, and queries are exact by
+    default. With approximate=True, unfiltered queries on an index of at least
+    `approximate_threshold` vectors go through an HNSW graph instead and its
+    candidates are rescored exactly; the graph's recall is printed when it is
+    built, so check it before relying on it.
+    Deleted and overwritten rows are tombstoned and compacted on save.
+    Call save() to persist to `path/`; the index loads from there on open.
+
+    With `quantization` ("int8" or "pq") unfiltered queries on an index of at
+    least `quantize_threshold` vectors scan compact codes held in memory
+    instead (smaller indexes stay exact, and say so once), and the best
+    `top_k * rescore_factor` candidates are rescored against the float32
+    vectors, which stay memory-mapped on disk after save. rescore_factor=0
+    ranks by the approximate code scores alone.
+    """
+
+    def __init__(self, path: str, dimension: int = 1536, metric: str = "cosine", approximate: bool = False,
+                 approximate_threshold: int = 5000, M: int = 16, ef_construction: int = 100, ef_search: int = 64,
+                 quantization: Optional[str] = None, pq_subspaces: Optional[int] = None, rescore_factor: int = 10,
+                 train_sample: int = 20000, recall_sample: int = 50, quantize_threshold: int = 256):
+        if metric not in ("cosine", "dotproduct"):
+            raise ValueError(f"Unsupported metric: {metric}")
+        self.path = path
+        self.dimension = dimension
+        self.metric = metric
+        self.approximate = approximate
+        self.approximate_threshold = approximate_threshold
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.quantization = quantization
+        # Enough vectors to train a codebook (PQ has 256 centroids per subspace)
+        self.quantize_threshold = max(1, quantize_threshold)
+        self._quantize_notice = False
+        self.pq_subspaces = pq_subspaces
+        self.rescore_factor = rescore_factor
+        self.train_sample = train_sample
+        self.recall_sample = recall_sample
+        self._lock = threading.RLock()
+
+        self._vectors = np.empty((0, dimension), dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._size = 0
+        self._ids: List[Optional[str]] = []  # None marks a tombstoned row
+        self._metadata: List[Optional[Dict]] = []
+        self._rows: Dict[str, int] = {}
+        self._columns: Dict[str, np.ndarray] = {}  # Metadata field -> object array by row, built when first filtered on
+        self._graph: Optional[HnswGraph] = None
+        self._quantizer = None
+        self._codes: Optional[np.ndarray] = None  # Codes for rows [0, len(codes)); later rows are scored exactly
+
+        if os.path.exists(os.path.join(path, 'records.json')):
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    # ---- Pinecone-compatible API ----
+
+    def upsert(self, vectors: List[Dict], namespace: Optional[str] = None) -> Dict[str, int]:
+        with self._lock:
+            for vector in vectors:
+                values = np.asarray(vector['values'], dtype=np.float32)
+                if values.shape != (self.dimension,):
+                    raise ValueError(f"Vector {vector['id']} has dimension {values.size}, index expects {self.dimension}")
+                if vector['id'] in self._rows:
+                    self._tombstone(self._rows[vector['id']])
+                row = self._append(self._prepare(values))
+                self._ids.append(vector['id'])
+                self._metadata.append(dict(vector.get('metadata') or {}))
+                self._rows[vector['id']] = row
+                for field, column in self._columns.items():
+                    column[row] = self._metadata[row].get(field)
+                if self._graph is not None:
+                    self._graph.add(self._vectors, row)
+        return {'upserted_count': len(vectors)}
+
+    def delete(self, ids: Optional[List[str]] = None, delete_all: bool = False, namespace: Optional[str] = None):
+        with self._lock:
+            if delete_all:
+                self._vectors = np.empty((0, self.dimension), dtype=np.float32)
+                self._alive = np.zeros(0, dtype=bool)
+                self._size = 0
+                self._ids, self._metadata, self._rows, self._graph = [], [], {}, None
+                self._columns = {}
+                self._quantizer, self._codes = None, None
+                return
+            for vector_id in ids or []:
+                if vector_id in self._rows:
+                    self._tombstone(self._rows[vector_id])
+
+    def fetch(self, ids: List[str], namespace: Optional[str] = None) -> Dict[str, QueryMatch]:
+        with self._lock:
+            return {
+                vector_id: QueryMatch(vector_id, 1.0, self._metadata[row], self._vectors[row].tolist())
+                for vector_id, row in ((vector_id, self._rows.get(vector_id)) for vector_id in ids)
+                if row is not None
+            }
+
+    def list(self, prefix: Optional[str] = None, limit: int = 100, namespace: Optional[str] = None) -> Iterator[List[str]]:
+        """Stored ids (optionally only those starting with `prefix`) in pages of `limit`, like Pinecone's Index.list"""
+        with self._lock:
+            ids = [vector_id for vector_id in self._rows if prefix is None or vector_id.startswith(prefix)]
+        for i in range(0, len(ids), limit):
+            yield ids[i:i + limit]
+
+    def query(self, vector: List[float], top_k: int = 10, include_metadata: bool = True,
+              include_values: bool = False, filter: Optional[Dict] = None, namespace: Optional[str] = None) -> QueryResult:
+        query = self._prepare(np.asarray(vector, dtype=np.float32))
+        with self._lock:
+            if not self._rows or top_k <= 0:
+                return QueryResult([])
+
+            approximate_scores = None
+            if filter:
+                # Prefilter: only rows whose metadata passes are scored
+                mask = filter_mask(lambda field: self._column(field)[:self._size], filter, self._size)
+                candidates = np.flatnonzero(mask & self._alive[:self._size])
+            elif self._quantized():
+                candidates, approximate_scores = self._quantized_candidates(query, top_k)
+            elif self.approximate and len(self._rows) >= self.approximate_threshold:
+                graph = self._ensure_graph()
+                candidates = np.array([row for row in graph.search(self._vectors, query, max(self.ef_search, top_k * 2))
+                                       if self._ids[row] is not None], dtype=np.int64)
+            else:
+                candidates = None
+
+            if candidates is None:
+                scores = np.where(self._alive[:self._size], self._vectors[:self._size] @ query, -np.inf)
+                rows = np.arange(self._size)
+            else:
+                if not len(candidates):
+                    return QueryResult([])
+                scores = approximate_scores if approximate_scores is not None else self._vectors[candidates] @ query
+                rows = candidates
+
+            k = min(top_k, len(self._rows), len(rows))
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+            return QueryResult([
+                QueryMatch(self._ids[rows[i]], float(scores[i]),
+                           self._metadata[rows[i]] if include_metadata else None,
+                           self._vectors[rows[i]].tolist() if include_values else None)
+                for i in best if np.isfinite(scores[i])
+            ])
+
+    def describe_index_stats(self) -> IndexStats:
+        return IndexStats(len(self._rows), self.dimension)
+
+    def recall_at_k(self, queries: np.ndarray, top_k: int = 10) -> float:
+        """Fraction of the exact top_k ids that query() returns, averaged over `queries`"""
+        hits, expected = 0, 0
+        for vector in queries:
+            found = {match.id for match in self.query(vector, top_k, include_metadata=False).matches}
+            query = self._prepare(np.asarray(vector, dtype=np.float32))
+            with self._lock:
+                scores = np.where(self._alive[:self._size], self._vectors[:self._size] @ query, -np.inf)
+                k = min(top_k, len(self._rows))
+                exact = {self._ids[row] for row in np.argpartition(-scores, k - 1)[:k]}
+            hits += len(found & exact)
+            expected += k
+        return hits / expected if expected else 1.0
+
+    def memory_bytes(self) -> Dict[str, int]:
+        """Bytes held by the float32 vectors and the quantized codes"""
+        return {
+            'vectors': self._size * self.dimension * 4,
+            'vectors_in_memory': 0 if isinstance(self._vectors, np.memmap) else self._vectors.nbytes,
+            'codes': self._codes.nbytes if self._codes is not None else 0,
+        }
+
+    # ---- Persistence ----
+
+    def save(self):
+        """Write vectors, records and the HNSW graph under `path/` (compacting tombstones first)"""
+        with self._lock:
+            if self._size - len(self._rows) > 0.25 * max(self._size, 1):
+                self._compact()
+            quantized = self._quantized()
+            if quantized:
+                self._ensure_codes()
+            elif self.approximate and self._graph is None and len(self._rows) >= self.approximate_threshold:
+                self._ensure_graph()
+
+            os.makedirs(self.path, exist_ok=True)
+            self._write(os.path.join(self.path, 'vectors.npy'),
+                        lambda f: np.save(f, self._vectors[:self._size]))
+            records = {'dimension': self.dimension, 'metric': self.metric, 'ids': self._ids, 'metadata': self._metadata}
+            self._write(os.path.join(self.path, 'records.json'),
+                        lambda f: f.write(json.dumps(records, ensure_ascii=False).encode('utf-8')))
+            graph_file = os.path.join(self.path, 'hnsw.npz')
+            if self._graph is not None:
+                self._write(graph_file, self._graph.save)
+            elif os.path.exists(graph_file):
+                os.remove(graph_file)
+
+            codes_file = os.path.join(self.path, 'codes.npy')
+            quantizer_file = os.path.join(self.path, 'quantizer.npz')
+            if quantized:
+                self._write(codes_file, lambda f: np.save(f, self._codes))
+                self._write(quantizer_file, lambda f: np.savez(f, kind=self._quantizer.kind, **self._quantizer.arrays()))
+                # Queries only read the rescored rows, so let the float32 matrix live in the page cache
+                self._vectors = np.load(os.path.join(self.path, 'vectors.npy'), mmap_mode='r')
+            else:
+                for filename in (codes_file, quantizer_file):
+                    if os.path.exists(filename):
+                        os.remove(filename)
+
+    def _load(self):
+        with open(os.path.join(self.path, 'records.json'), 'r', encoding='utf-8') as f:
+            records = json.load(f)
+        if records['dimension'] != self.dimension:
+            raise ValueError(f"Index at {self.path} has dimension {records['dimension']}, expected {self.dimension}")
+        self.metric = records.get('metric', self.metric)
+        self._ids, self._metadata = records['ids'], records['metadata']
+        self._vectors = np.load(os.path.join(self.path, 'vectors.npy'), mmap_mode='r')
+        self._size = len(self._ids)
+        self._alive = np.array([vector_id is not None for vector_id in self._ids], dtype=bool)
+        self._rows = {vector_id: row for row, vector_id in enumerate(self._ids) if vector_id is not None}
+        self._columns = {}
+        graph_file = os.path.join(self.path, 'hnsw.npz')
+        if self.approximate and not self.quantization and os.path.exists(graph_file):
+            self._graph = HnswGraph.load(graph_file)
+        quantizer_file = os.path.join(self.path, 'quantizer.npz')
+        if self.quantization and os.path.exists(quantizer_file):
+            quantizer = load_quantizer(quantizer_file)
+            # A different quantization (or PQ layout) is retrained on demand
+            if quantizer.kind == self.quantization and (
+                    quantizer.kind != "pq" or self.pq_subspaces in (None, quantizer.subspaces)):
+                self._quantizer = quantizer
+                self._codes = np.load(os.path.join(self.path, 'codes.npy'))
+
+    @staticmethod
+    def _write(filename: str, write_fn):
+        tmp_file = f"{filename}.tmp"
+        with open(tmp_file, 'wb') as f:
+            write_fn(f)
+        os.replace(tmp_file, filename)
+
+    # ---- Internals ----
+
+    def _prepare(self, values: np.ndarray) -> np.ndarray:
+        if self.metric == "cosine":
+            norm = np.linalg.norm(values)
+            if norm > 0:
+                values = values / norm
+        return values.astype(np.float32, copy=False)
+
+    def _append(self, values: np.ndarray) -> int:
+        # Memory-mapped (read-only) or full matrices are copied into a larger buffer
+        if self._size == len(self._vectors) or not self._vectors.flags.writeable:
+            capacity = max(1024, 2 * self._size, len(self._vectors))
+            grown = np.empty((capacity, self.dimension), dtype=np.float32)
+            grown[:self._size] = self._vectors[:self._size]
+            self._vectors = grown
+            alive = np.zeros(capacity, dtype=bool)
+            alive[:self._size] = self._alive[:self._size]
+            self._alive = alive
+            for field, column in self._columns.items():
+                grown_column = np.empty(capacity, dtype=object)
+                grown_column[:self._size] = column[:self._size]
+                self._columns[field] = grown_column
+        self._vectors[self._size] = values
+        self._alive[self._size] = True
+        self._size += 1
+        return self._size - 1
+
+    def _tombstone(self, row: int):
+        del self._rows[self._ids[row]]
+        self._alive[row] = False
+        self._ids[row] = None
+        self._metadata[row] = None
+        for column in self._columns.values():
+            column[row] = None
+
+    def _compact(self):
+        alive = [row for row, vector_id in enumerate(self._ids) if vector_id is not None]
+        self._vectors = np.ascontiguousarray(self._vectors[alive])
+        self._alive = np.ones(len(alive), dtype=bool)
+        self._ids = [self._ids[row] for row in alive]
+        self._metadata = [self._metadata[row] for row in alive]
+        self._columns = {field: column[alive] for field, column in self._columns.items()}
+        self._size = len(alive)
+        self._rows = {vector_id: row for row, vector_id in enumerate(self._ids)}
+        self._graph = None  # Row numbers changed; rebuilt on demand
+        self._codes = None  # Re-encoded on demand with the trained quantizer
+
+    def _column(self, field: str) -> np.ndarray:
+        """Values of one metadata field by row (same capacity as the vectors), kept in sync from then on"""
+        column = self._columns.get(field)
+        if column is None:
+            column = np.empty(len(self._vectors), dtype=object)
+            for row in range(self._size):
+                metadata = self._metadata[row]
+                column[row] = metadata.get(field) if metadata is not None else None
+            self._columns[field] = column
+        return column
+
+    def _ensure_graph(self) -> HnswGraph:
+        if self._graph is None:
+            start = time.perf_counter()
+            graph = HnswGraph(self.M, self.ef_construction)
+            for row in range(self._size):
+                graph.add(self._vectors, row)
+            self._graph = graph
+            print(f"🕸️  Built HNSW graph over {self._size:,} vectors in {time.perf_counter() - start:.1f}s")
+
+            rows = list(self._rows.values())
+            sample = random.Random(0).sample(rows, min(len(rows), self.recall_sample))
+            recall = self.recall_at_k(self._vectors[sample], top_k=10)
+            print(f"🎯 HNSW recall@10 vs exact search: {recall:.1%} on {len(sample)} stored vectors"
+                  + ("" if recall >= 0.9 else " - consider approximate=False or a higher ef_search"))
+        return self._graph
+
+    def _quantized(self) -> bool:
+        """Whether unfiltered queries use the quantized codes (configured and enough vectors to train on)"""
+        if not self.quantization:
+            return False
+        if len(self._rows) >= self.quantize_threshold:
+            return True
+        if not self._quantize_notice:
+            self._quantize_notice = True
+            print(f"ℹ️  {self.quantization} quantization inactive: {len(self._rows):,} vectors, "
+                  f"needs {self.quantize_threshold:,} (quantize_threshold) - searching exactly")
+        return False
+
+    def _ensure_codes(self) -> np.ndarray:
+        """Train the quantizer on a sample of live rows if needed, then encode rows not yet coded"""
+        if self._quantizer is None:
+            start = time.perf_counter()
+            alive = np.flatnonzero(self._alive[:self._size])
+            if len(alive) > self.train_sample:
+                alive = np.sort(np.random.default_rng(42).choice(alive, self.train_sample, replace=False))
+            quantizer = make_quantizer(self.quantization, self.dimension, self.pq_subspaces)
+            quantizer.train(np.asarray(self._vectors[alive], dtype=np.float32))
+            self._quantizer, self._codes = quantizer, None
+            print(f"🗜️  Trained {quantizer.kind} quantizer on {len(alive):,} vectors in {time.perf_counter() - start:.1f}s")
+
+        coded = 0 if self._codes is None else len(self._codes)
+        if coded < self._size:
+            new_codes = self._quantizer.encode(self._vectors[coded:self._size])
+            self._codes = new_codes if self._codes is None else np.concatenate([self._codes, new_codes])
+        return self._codes
+
+    def _quantized_candidates(self, query: np.ndarray, top_k: int):
+        """(candidate rows, their approximate scores or None to rescore exactly) from the code scan"""
+        if self._quantizer is None:
+            self._ensure_codes()
+        codes = self._codes if self._codes is not None else np.empty((0, 0), dtype=np.uint8)
+        coded = len(codes)
+        scores = np.where(self._alive[:coded], self._quantizer.scores(codes, query), -np.inf)
+        # Rows upserted since the last encode are few; they are scored exactly
+        tail = np.flatnonzero(self._alive[coded:self._size]) + coded
+
+        if self.rescore_factor <= 0:
+            rows = np.concatenate([np.arange(coded), tail])
+            return rows, np.concatenate([scores, self._vectors[tail] @ query])
+
+        shortlist_size = min(coded, top_k * self.rescore_factor)
+        shortlist = np.argpartition(-scores, shortlist_size - 1)[:shortlist_size] if shortlist_size else tail[:0]
+        shortlist = shortlist[np.isfinite(scores[shortlist])]
+        return np.concatenate([np.sort(shortlist), tail]), None
+
+# =============================================================================
+# STORES
+# =============================================================================
+
+def backend_file(filename: str, backend: str) -> str:
+    """Per-backend name for a file kept in sync with a vector store, e.g. keyword_index.local.sqlite"""
+    if not backend:
+        return filename
+    root, ext = os.path.splitext(filename)
+    return f"{root}.{backend}{ext}"
+
+class VectorStore:
+    """Registry of named indexes; Index(name) returns a handle with the Pinecone Index API
+
+    `kind` names the backend, so state synced with one backend is never reused for another.
+    """
+
+    kind = ""
+
+    def has_index(self, name: str) -> bool:
+        raise NotImplementedError
+
+    def create_index(self, name: str, dimension: int, metric: str = "cosine"):
+        raise NotImplementedError
+
+    def index_dimension(self, name: str) -> int:
+        """Dimension an existing index was created with"""
+        raise NotImplementedError
+
+    def Index(self, name: str):
+        raise NotImplementedError
+
+    def persist(self, index):
+        """Make writes durable; remote stores already are"""
+
+class PineconeVectorStore(VectorStore):
+    """Pinecone indexes, with existence cached and one long-lived handle per index
+
+    Each handle keeps its own HTTP connection pool (`pool_threads` connections),
+    so upserts and queries through it reuse warm connections.
+    """
+
+    kind = "pinecone"
+
+    def __init__(self, api_key: str, cloud: str = "aws", region: str = "us-east-1", pool_threads: int = 4,
+                 ready_timeout: float = 300.0):
+        from pinecone import Pinecone
+        self.pc = Pinecone(api_key=api_key)
+        self.cloud = cloud
+        self.region = region
+        self.pool_threads = pool_threads
+        self.ready_timeout = ready_timeout
+        self._existing = set()
+        self._handles = {}
+        self._lock = threading.Lock()
+
+    def has_index(self, name: str) -> bool:
+        if name not in self._existing:
+            self._existing.update(index.name for index in self.pc.list_indexes())
+        return name in self._existing
+
+    def create_index(self, name: str, dimension: int, metric: str = "cosine"):
+        from pinecone import ServerlessSpec
+        self.pc.create_index(
+            name=name,
+            dimension=dimension,
+            metric=metric,
+            spec=ServerlessSpec(cloud=self.cloud, region=self.region)
+        )
+        self.wait_until_ready(name)
+        self._existing.add(name)
+
+    def index_dimension(self, name: str) -> int:
+        return int(self.pc.describe_index(name).dimension)
+
+    def wait_until_ready(self, name: str, timeout: Optional[float] = None):
+        """Poll describe_index until the index reports ready, with backoff up to a deadline"""
+        timeout = self.ready_timeout if timeout is None else timeout
+        print("⏳ Waiting for index to be ready...")
+        start = time.monotonic()
+        delay = 0.5
+        while True:
+            status = self.pc.describe_index(name).status
+            try:
+                ready = status['ready']
+            except (TypeError, KeyError):
+                ready = getattr(status, 'ready', False)
+            if ready:
+                print(f"✅ Index ready after {time.monotonic() - start:.1f}s")
+                return
+            remaining = start + timeout - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"Pinecone index {name} not ready after {timeout:.0f}s")
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 5.0)
+
+    def Index(self, name: str):
+        with self._lock:
+            if name not in self._handles:
+                self._handles[name] = self.pc.Index(name, pool_threads=self.pool_threads)
+            return self._handles[name]
+
+class LocalVectorStore(VectorStore):
+    """Indexes saved as directories under `directory`, loaded once and shared per process"""
+
+    kind = "local"
+
+    def __init__(self, directory: str = "vector_indexes", **index_options):
+        self.directory = directory
+        self.index_options = index_options
+        self._indexes: Dict[str, LocalVectorIndex] = {}
+        self._lock = threading.Lock()
+
+    def has_index(self, name: str) -> bool:
+        return name in self._indexes or os.path.exists(os.path.join(self.directory, name, 'records.json'))
+
+    def create_index(self, name: str, dimension: int, metric: str = "cosine"):
+        with self._lock:
+            index = LocalVectorIndex(os.path.join(self.directory, name), dimension, metric, **self.index_options)
+            index.save()
+            self._indexes[name] = index
+
+    def index_dimension(self, name: str) -> int:
+        if name in self._indexes:
+            return self._indexes[name].dimension
+        with open(os.path.join(self.directory, name, 'records.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)['dimension']
+
+    def Index(self, name: str) -> LocalVectorIndex:
+        with self._lock:
+            if name not in self._indexes:
+                path = os.path.join(self.directory, name)
+                self._indexes[name] = LocalVectorIndex(path, self.index_dimension(name), **self.index_options)
+            return self._indexes[name]
+
+    def persist(self, index: LocalVectorIndex):
+        index.save()
+
+def open_vector_store(backend: str = "pinecone", pinecone_api_key: Optional[str] = None,
+                      local_dir: str = "vector_indexes", quantization: Optional[str] = None,
+                      **index_options) -> VectorStore:
+    """Vector store for a config value: "pinecone" or "local" (optionally "int8"/"pq" quantized)
+
+    `index_options` (e.g. quantize_threshold) are passed on to each LocalVectorIndex.
+    """
+    if backend == "local":
+        return LocalVectorStore(local_dir, quantization=quantization, **index_options)
+    if backend == "pinecone":
+        return PineconeVectorStore(pinecone_api_key)
+    raise ValueError(f"Unknown vector store backend: {backend}")